@@ -0,0 +1,194 @@
+'''Pluggable JSON libraries for the ``is_json`` decoding methods of
+:class:`~micromodels.Model` and for :meth:`~micromodels.Model.to_json`.
+
+The standard library's :mod:`json` module is used unless another library
+is chosen, either for every model::
+
+    from micromodels import backends
+
+    backends.set_default('ujson')
+    backends.set_default('auto')  # the fastest library that is installed
+
+or for one model class and its subclasses::
+
+    class Tweet(micromodels.Model):
+        __json__ = 'rapidjson'
+
+``__json__`` may also be a :class:`Backend`, for example one made by
+:func:`get` with options for the library::
+
+    class Tweet(micromodels.Model):
+        __json__ = backends.get('json', sort_keys=True)
+
+Every backend returns text from ``dumps``, whatever the library returns, and
+raises ``ValueError`` for invalid documents. The values models encode are
+already serialized, so libraries which could encode dates themselves are not
+asked to. The exact text differs between libraries (in its spacing, or in
+whether non-ASCII characters are escaped), but it always decodes to the same
+value. :meth:`~micromodels.Model.to_json` with a stream always uses the
+incremental encoder in :mod:`micromodels.encoder`.
+
+'''
+import threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+# The libraries 'auto' chooses from, fastest first.
+AUTO_ORDER = ('orjson', 'rapidjson', 'ujson', 'json')
+
+_lock = threading.Lock()
+_backends = {}
+
+
+class Backend(object):
+    """A JSON library as micromodels uses it: ``loads(text)`` returns the
+    decoded value and ``dumps(value)`` returns the JSON text.
+
+    """
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def __repr__(self):
+        return '<Backend %r>' % self.name
+
+
+def _stdlib(module):
+    def factory(**options):
+        dumps = module.dumps
+        if options:
+            dumps = lambda value: module.dumps(value, **options)
+        return Backend(module.__name__, module.loads, dumps)
+    return factory
+
+
+def _simplejson(**options):
+    import simplejson
+    return _stdlib(simplejson)(**options)
+
+
+def _ujson(**options):
+    import ujson
+    # ujson escapes forward slashes unless told not to, unlike the others.
+    options.setdefault('escape_forward_slashes', False)
+    return Backend('ujson', ujson.loads,
+                   lambda value: ujson.dumps(value, **options))
+
+
+def _rapidjson(**options):
+    import rapidjson
+    return Backend('rapidjson', rapidjson.loads,
+                   lambda value: rapidjson.dumps(value, **options))
+
+
+def _orjson(option=None):
+    import orjson
+    dumps = orjson.dumps
+    if option is None:
+        encode = lambda value: dumps(value).decode('utf-8')
+    else:
+        encode = lambda value: dumps(value, option=option).decode('utf-8')
+    # orjson only takes byte strings or str, not Python 2's unicode.
+    loads = orjson.loads
+
+    def decode(text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return loads(text)
+    return Backend('orjson', decode, encode)
+
+
+# Factories for the libraries micromodels knows how to use. Each imports its
+# library, raising ImportError if it is not installed.
+FACTORIES = {
+    'json': _stdlib(json),
+    'simplejson': _simplejson,
+    'ujson': _ujson,
+    'rapidjson': _rapidjson,
+    'orjson': _orjson,
+}
+
+
+def available():
+    '''Returns the names of the libraries which are installed.'''
+    names = []
+    for name in sorted(FACTORIES):
+        try:
+            get(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get(name, **options):
+    '''Returns a backend for the library ``name``, or for the fastest one
+    installed if ``name`` is ``'auto'``. ``options`` are passed to the
+    library's ``dumps`` function, or as orjson's ``option`` flags. Raises
+    ``ImportError`` if the library is not installed and ``ValueError`` if
+    micromodels does not know it.
+
+    Backends without options are made once and shared, and ``'auto'`` is
+    then only resolved once.
+
+    '''
+    if name == 'auto':
+        if not options:
+            backend = _backends.get('auto')
+            if backend is not None:
+                return backend
+        for name in AUTO_ORDER:
+            try:
+                backend = get(name, **options)
+            except ImportError:
+                continue
+            if not options:
+                _backends['auto'] = backend
+            return backend
+    if name not in FACTORIES:
+        raise ValueError('Unknown JSON library %r' % name)
+    if options:
+        return FACTORIES[name](**options)
+    backend = _backends.get(name)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = _backends[name] = FACTORIES[name]()
+    return backend
+
+
+_default = get('json')
+
+
+def default():
+    '''Returns the backend used by models which do not choose their own.'''
+    return _default
+
+
+def set_default(name, **options):
+    '''Makes the library ``name`` the default for every model which does not
+    choose its own, and returns its backend. ``name`` may also be a
+    :class:`Backend`.
+
+    '''
+    global _default
+    if isinstance(name, Backend):
+        _default = name
+    else:
+        _default = get(name, **options)
+    return _default
+
+
+def _for_model(cls):
+    '''Returns the backend for the model class ``cls``.'''
+    backend = cls.__json__
+    if backend is None:
+        return _default
+    if isinstance(backend, basestring):
+        return get(backend)
+    return backend
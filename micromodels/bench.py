@@ -0,0 +1,304 @@
+'''Benchmarks for decoding and encoding models.
+
+Run ``python -m micromodels.bench`` to time a set of synthetic workloads.
+For each workload it reports records per second, the memory held per
+decoded record and peak memory use, and can write the results as JSON so
+that runs against different commits can be compared::
+
+    python -m micromodels.bench --output before.json
+    python -m micromodels.bench --records 2000 --workload flat \
+        --workload datetime
+
+The memory held per record is measured with :mod:`tracemalloc` if it is
+available, and otherwise estimated by adding up the sizes of the objects
+that make up the decoded records. Peak memory is the peak resident set size
+of the process, on platforms that have the :mod:`resource` module.
+
+'''
+import datetime
+import gc
+import optparse
+import platform
+import sys
+import time
+import types
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import micromodels
+
+
+def _model(name, fields):
+    return type(micromodels.Model)(name, (micromodels.Model,),
+                                   dict(fields, __module__=__name__))
+
+
+def _flat_fields():
+    return [(kind + str(i), field())
+            for i in range(5)
+            for kind, field in [('name', micromodels.CharField),
+                                ('count', micromodels.IntegerField),
+                                ('ratio', micromodels.FloatField),
+                                ('flag', micromodels.BooleanField)]]
+
+
+FlatRecord = _model('FlatRecord', _flat_fields())
+CompactFlatRecord = _model('CompactFlatRecord',
+                           _flat_fields() + [('__compact__', True)])
+
+# Node is the outermost of ten levels of nested models.
+Node = None
+for _depth in range(10):
+    Node = _model('Node', [('name', micromodels.CharField()),
+                           ('value', micromodels.IntegerField())] +
+                  ([('child', micromodels.ModelField(Node))] if Node else []))
+del _depth
+
+
+class Item(micromodels.Model):
+    id = micromodels.IntegerField()
+    label = micromodels.CharField()
+    price = micromodels.FloatField()
+
+
+class Page(micromodels.Model):
+    title = micromodels.CharField()
+    items = micromodels.ModelCollectionField(Item)
+
+
+class Event(micromodels.Model):
+    created = micromodels.DateTimeField()
+    updated = micromodels.DateTimeField()
+    logged = micromodels.DateTimeField(format='%Y-%m-%d %H:%M:%S')
+    day = micromodels.DateField('%Y-%m-%d')
+    at = micromodels.TimeField()
+
+
+def _flat_data(n):
+    data = {}
+    for i in range(5):
+        data['name%d' % i] = u'name %d %d' % (n, i)
+        data['count%d' % i] = n * i
+        data['ratio%d' % i] = n / 7.0
+        data['flag%d' % i] = bool(n % 2)
+    return data
+
+
+def _nested_data(n, depth=10):
+    data = None
+    for level in range(depth):
+        data = {'name': u'level %d' % level, 'value': n + level,
+                'child': data}
+    return data
+
+
+def _page_data(n, width=100):
+    return {'title': u'page %d' % n,
+            'items': [{'id': n * width + i, 'label': u'item %d' % i,
+                       'price': i * 1.25} for i in range(width)]}
+
+
+def _event_data(n):
+    moment = datetime.datetime(2012, 1, 1) + datetime.timedelta(minutes=n)
+    return {'created': moment.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'updated': moment.strftime('%Y-%m-%dT%H:%M:%S.123456+01:00'),
+            'logged': moment.strftime('%Y-%m-%d %H:%M:%S'),
+            'day': moment.strftime('%Y-%m-%d'),
+            'at': moment.strftime('%H:%M:%S')}
+
+
+def _decode(cls, make_data):
+    def setup(records):
+        return [make_data(n) for n in range(records)]
+
+    def run(payloads):
+        from_dict = cls.from_dict
+        return [from_dict(data) for data in payloads]
+    return setup, run
+
+
+def _setattr_workload():
+    def setup(records):
+        return [_flat_data(n) for n in range(records)]
+
+    def run(payloads):
+        instances = []
+        for data in payloads:
+            instance = FlatRecord()
+            for key, value in data.iteritems():
+                setattr(instance, key, value)
+            instances.append(instance)
+        return instances
+    return setup, run
+
+
+def _round_trip_workload():
+    def setup(records):
+        return [json.dumps(_page_data(n, 10)) for n in range(records)]
+
+    def run(payloads):
+        from_dict = Page.from_dict
+        return [from_dict(data, is_json=True).to_json() for data in payloads]
+    return setup, run
+
+
+# Name, description and factory of each workload, and the number of records
+# it runs by default.
+WORKLOADS = [
+    ('flat', 'decode a flat model of 20 scalar fields',
+     lambda: _decode(FlatRecord, _flat_data), 20000),
+    ('compact', 'decode the flat model with __compact__ = True',
+     lambda: _decode(CompactFlatRecord, _flat_data), 20000),
+    ('setattr', 'set the 20 fields of a flat model one by one',
+     _setattr_workload, 10000),
+    ('nested', 'decode ModelFields nested 10 deep',
+     lambda: _decode(Node, _nested_data), 5000),
+    ('wide', 'decode a ModelCollectionField of 100 items',
+     lambda: _decode(Page, _page_data), 500),
+    ('datetime', 'decode 5 date and time fields',
+     lambda: _decode(Event, _event_data), 10000),
+    ('round_trip', 'decode from JSON and encode back with to_json',
+     _round_trip_workload, 5000),
+]
+
+
+_SHARED_TYPES = (type, types.ClassType, types.FunctionType,
+                 types.BuiltinFunctionType, types.MethodType, types.ModuleType)
+
+
+def _reachable(root, seen):
+    '''Yields the objects reachable from ``root`` which are not in ``seen``
+    (a set of object ids, which is updated), skipping classes, functions
+    and modules.
+
+    '''
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        yield obj
+        stack.extend(gc.get_referents(obj))
+
+
+def _held_memory(run, payloads):
+    '''Runs ``run`` once, returning the number of bytes held by its result
+    and how they were measured.
+
+    '''
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            result = run(payloads)
+            held = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        return held, 'tracemalloc'
+    # Without tracemalloc, add up the sizes of the objects in the result,
+    # leaving out those it shares with the payloads.
+    result = run(payloads)
+    seen = set()
+    for obj in _reachable(payloads, seen):
+        pass
+    seen.add(id(payloads))
+    held = sum(sys.getsizeof(obj) for obj in _reachable(result, seen))
+    return held, 'getsizeof'
+
+
+def run_workload(name, records=None, repeat=3):
+    '''Runs the workload ``name`` and returns its results as a dictionary.'''
+    for workload, description, factory, default_records in WORKLOADS:
+        if workload == name:
+            break
+    else:
+        raise ValueError('Unknown workload %r' % name)
+    records = records or default_records
+    setup, run = factory()
+    payloads = setup(records)
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.time()
+        result = run(payloads)
+        timings.append(time.time() - start)
+        del result
+    held, unit = _held_memory(run, payloads)
+    best = min(timings)
+    return {
+        'description': description,
+        'records': records,
+        'repeat': repeat,
+        'best_seconds': best,
+        'records_per_second': records / best if best else None,
+        'bytes_held_per_record': float(held) / records,
+        'memory_measured_with': unit,
+    }
+
+
+def _peak_rss():
+    '''Returns the peak resident set size of the process in kilobytes.'''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+def run(names=None, records=None, repeat=3):
+    '''Runs the named workloads (or all of them) and returns a report.'''
+    names = names or [workload[0] for workload in WORKLOADS]
+    results = {}
+    for name in names:
+        results[name] = run_workload(name, records, repeat)
+    return {
+        'micromodels': micromodels.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'results': results,
+        'peak_rss_kb': _peak_rss(),
+    }
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-w', '--workload', action='append', dest='workloads',
+                      choices=[workload[0] for workload in WORKLOADS],
+                      help='run only this workload (may be repeated)')
+    parser.add_option('-n', '--records', type='int',
+                      help='number of records for every workload')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='timed runs of each workload [default: %default]')
+    parser.add_option('-o', '--output',
+                      help='write the results to this file as JSON')
+    options, args = parser.parse_args(argv)
+    report = run(options.workloads, options.records, options.repeat)
+    for name, result in sorted(report['results'].items()):
+        print '%-12s %10.0f records/s %10.0f bytes/record   (%s)' % (
+            name, result['records_per_second'],
+            result['bytes_held_per_record'], result['description'])
+    if report['peak_rss_kb'] is not None:
+        print 'peak RSS: %d kB' % report['peak_rss_kb']
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+'''MessagePack encoding of model trees, for caches and for handing models
+between processes.
+
+Unlike :meth:`~micromodels.Model.to_json`, this keeps the converted values of
+every model in the tree, so decoding does not convert anything again: dates
+and times are packed as MessagePack extension types and nested models are
+rebuilt directly from their packed values. Decoding therefore trusts its
+input as much as unpickling does, and should only be given data which this
+module produced.
+
+Each model is packed as an array of its converted values, its raw values
+(see :meth:`~micromodels.Model.raw_value`) and the values a projection left
+out. Lazy and columnar collections are packed as their source items and
+rebuilt as the same kind of collection; the items of lazy collections which
+were converted are packed converted. Values of other types which MessagePack
+cannot hold, tuples included, are pickled into an extension type. Fields
+added with :meth:`~micromodels.Model.add_field` are not packed.
+
+This needs the ``msgpack`` package, version 0.6.1 or later.
+
+'''
+import datetime
+import pickle
+import struct
+import weakref
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from . import dates
+from .columns import ModelCollectionList
+from .encoder import _MODEL, _MODELS
+from .sequences import LazyList, _missing as _missing_item
+
+_missing = object()
+
+# Extension type codes, and the layouts of the date and time values.
+_NAIVE_DATETIME, _AWARE_DATETIME, _DATE, _TIME, _PICKLED = range(1, 6)
+_datetime = struct.Struct('>HBBBBBI')
+_aware_datetime = struct.Struct('>HBBBBBIh')
+_date = struct.Struct('>HBB')
+_time = struct.Struct('>BBBI')
+
+# The fields of each class whose values need rebuilding: name, kind, field.
+_nested = weakref.WeakKeyDictionary()
+
+
+def _require_msgpack():
+    if msgpack is None:
+        raise ImportError('MessagePack encoding needs the msgpack package')
+
+
+def _default(value):
+    kind = type(value)
+    if kind is datetime.datetime:
+        offset = value.utcoffset()
+        if offset is None:
+            return msgpack.ExtType(_NAIVE_DATETIME, _datetime.pack(
+                value.year, value.month, value.day, value.hour,
+                value.minute, value.second, value.microsecond))
+        minutes = offset.days * 1440 + offset.seconds // 60
+        return msgpack.ExtType(_AWARE_DATETIME, _aware_datetime.pack(
+            value.year, value.month, value.day, value.hour, value.minute,
+            value.second, value.microsecond, minutes))
+    if kind is datetime.date:
+        return msgpack.ExtType(_DATE, _date.pack(value.year, value.month,
+                                                 value.day))
+    if kind is datetime.time and value.tzinfo is None:
+        return msgpack.ExtType(_TIME, _time.pack(
+            value.hour, value.minute, value.second, value.microsecond))
+    return msgpack.ExtType(_PICKLED,
+                           pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+def _offset_timezone(minutes):
+    if not minutes:
+        return dates._timezone('Z')
+    sign = '-' if minutes < 0 else '+'
+    return dates._timezone('%s%02d:%02d' % ((sign,) + divmod(abs(minutes),
+                                                               60)))
+
+
+def _ext_hook(code, data):
+    if code == _NAIVE_DATETIME:
+        return datetime.datetime(*_datetime.unpack(data))
+    if code == _AWARE_DATETIME:
+        values = _aware_datetime.unpack(data)
+        return datetime.datetime(*values[:7],
+                                 tzinfo=_offset_timezone(values[7]))
+    if code == _DATE:
+        return datetime.date(*_date.unpack(data))
+    if code == _TIME:
+        return datetime.time(*_time.unpack(data))
+    if code == _PICKLED:
+        return pickle.loads(data)
+    return msgpack.ExtType(code, data)
+
+
+def _nested_fields(cls):
+    '''Returns the name, kind and field of each field of ``cls`` whose
+    values need rebuilding: nested models and lazy or columnar collections.
+
+    '''
+    try:
+        return _nested[cls]
+    except KeyError:
+        pass
+    nested = []
+    for name, field, key, kind in cls._json_plan:
+        if (kind is _MODEL or kind is _MODELS or
+                getattr(field, 'lazy', False)):
+            nested.append((name, kind, field))
+    nested = _nested[cls] = tuple(nested)
+    return nested
+
+
+def _packable(instance):
+    '''Returns the array ``instance`` is packed as.'''
+    from .models import Model
+    values = {}
+    raw = instance._raw
+    for name, field, key, kind in type(instance)._json_plan:
+        if name in raw:
+            continue
+        value = getattr(instance, name, _missing)
+        if value is _missing:
+            continue
+        if type(value) is LazyList:
+            # The source items are packed as they are, with the items
+            # converted so far.
+            values[name] = {'lazy': value._items, 'converted': [
+                [index, _packable(item) if isinstance(item, Model) else item]
+                for index, item in enumerate(value._values)
+                if item is not _missing_item]}
+        elif type(value) is ModelCollectionList:
+            values[name] = {'columnar': value._source_rows()}
+        elif kind is _MODEL and isinstance(value, Model):
+            values[name] = _packable(value)
+        elif kind is _MODELS and type(value) is list:
+            values[name] = [_packable(item) for item in value]
+        else:
+            values[name] = value
+    return [values, dict(raw) or None, dict(instance._skipped) or None]
+
+
+def _build(cls, packed):
+    '''Rebuilds an instance of ``cls`` from the array it was packed as.'''
+    values, raw, skipped = packed
+    instance = cls.__new__(cls)
+    for name, kind, field in _nested_fields(cls):
+        value = values.get(name)
+        if value is None:
+            continue
+        wrapped_class = getattr(field, '_wrapped_class', None)
+        related_name = getattr(field, '_related_name', None)
+        if type(value) is dict and getattr(field, 'lazy', False):
+            lazy = values[name] = LazyList(field, value['lazy'], instance)
+            for index, item in value['converted']:
+                if kind is _MODELS:
+                    item = _build(wrapped_class, item)
+                    if related_name is not None:
+                        setattr(item, related_name, instance)
+                lazy._values[index] = item
+        elif type(value) is dict and getattr(field, 'columnar', False):
+            values[name] = ModelCollectionList(
+                wrapped_class, value['columnar'], related_name, instance)
+        elif kind is _MODEL:
+            value = values[name] = _build(wrapped_class, value)
+            if related_name is not None:
+                setattr(value, related_name, instance)
+        elif kind is _MODELS:
+            value = values[name] = [_build(wrapped_class, item)
+                                    for item in value]
+            if related_name is not None:
+                for item in value:
+                    setattr(item, related_name, instance)
+    if raw:
+        values['_raw'] = raw
+    if skipped:
+        values['_skipped'] = skipped
+    instance.__setstate__(values)
+    return instance
+
+
+def pack(instance):
+    '''Returns ``instance`` and the models nested in it as MessagePack
+    bytes.
+
+    '''
+    _require_msgpack()
+    return msgpack.packb(_packable(instance), default=_default,
+                         use_bin_type=True, strict_types=True)
+
+
+def unpack(cls, data):
+    '''Returns the instance of ``cls`` packed in ``data`` by :func:`pack`.'''
+    _require_msgpack()
+    packed = msgpack.unpackb(data, ext_hook=_ext_hook, raw=False,
+                             strict_map_key=False)
+    return _build(cls, packed)
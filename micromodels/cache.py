@@ -0,0 +1,187 @@
+import hashlib
+import threading
+import time
+
+
+class LRUCache(object):
+    """A thread-safe mapping which holds at most ``maxsize`` entries,
+    discarding the least recently used entry when it is full.
+
+    If ``ttl`` is given, entries also expire ``ttl`` seconds after they
+    were set, as measured by ``timer``.
+
+    ``hits`` and ``misses`` count the lookups made with :meth:`get`, and
+    ``expired`` the misses due to expired entries.
+
+    """
+    def __init__(self, maxsize, ttl=None, timer=time.time):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        '''Removes every entry and resets the counters.'''
+        with self._lock:
+            self.hits = self.misses = self.expired = 0
+            self._links = {}
+            # The entries form a circular doubly linked list of
+            # [previous, next, key, value, expiry] links, most recently used
+            # last.
+            root = self._root = []
+            root[:] = [root, root, None, None, None]
+
+    def get(self, key, default=None):
+        '''Returns the value cached for ``key``, or ``default``. Raises
+        ``TypeError`` if ``key`` is not hashable.
+
+        '''
+        with self._lock:
+            link = self._links.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            previous, next_ = link[0], link[1]
+            previous[1] = next_
+            next_[0] = previous
+            if link[4] is not None and link[4] <= self._timer():
+                del self._links[key]
+                self.misses += 1
+                self.expired += 1
+                return default
+            self.hits += 1
+            root = self._root
+            last = root[0]
+            last[1] = root[0] = link
+            link[0] = last
+            link[1] = root
+            return link[3]
+
+    def set(self, key, value):
+        '''Caches ``value`` for ``key``.'''
+        expiry = None if self.ttl is None else self._timer() + self.ttl
+        with self._lock:
+            links = self._links
+            if key in links:
+                links[key][3:] = [value, expiry]
+                return
+            root = self._root
+            if len(links) >= self.maxsize:
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del links[oldest[2]]
+            last = root[0]
+            link = [last, root, key, value, expiry]
+            last[1] = root[0] = links[key] = link
+
+    def delete(self, key):
+        '''Removes the entry for ``key``, if there is one.'''
+        with self._lock:
+            link = self._links.pop(key, None)
+            if link is not None:
+                link[0][1] = link[1]
+                link[1][0] = link[0]
+
+    def keys(self):
+        '''Returns the keys of the entries, least recently used first.'''
+        with self._lock:
+            keys = []
+            root = self._root
+            link = root[1]
+            while link is not root:
+                keys.append(link[2])
+                link = link[1]
+            return keys
+
+    def stats(self):
+        '''Returns the counters and size of the cache as a dictionary.'''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._links), 'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._links)
+
+    def __getstate__(self):
+        return {'maxsize': self.maxsize, 'ttl': self.ttl}
+
+    def __setstate__(self, state):
+        self.__init__(state['maxsize'], state.get('ttl'))
+
+
+class DecodeCache(object):
+    """Caches decoded model instances by model class and a digest of the
+    JSON text they were decoded from, for services which keep receiving the
+    same documents. Pass it to :meth:`~micromodels.Model.from_dict` as
+    ``cache``, or set it as the ``__cache__`` of a model class.
+
+    It holds at most ``maxsize`` instances, each for at most ``ttl``
+    seconds if ``ttl`` is given. On a hit, a copy of the cached instance
+    is returned: its nested models, lists and mappings are copied, and
+    everything else is shared. If ``shared`` is ``True`` the cached
+    instance itself is returned instead, which is cheaper but means that
+    it must never be modified.
+
+    """
+    def __init__(self, maxsize=1000, ttl=None, shared=False, timer=time.time):
+        self.shared = shared
+        self._instances = LRUCache(maxsize, ttl, timer)
+
+    @staticmethod
+    def _digest(payload):
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+        return hashlib.sha1(payload).digest()
+
+    def _key(self, cls, payload, *options):
+        '''Returns the cache key for decoding ``payload`` into ``cls`` with
+        the decoding ``options``, or ``None`` if ``payload`` is not JSON text.
+
+        '''
+        if not isinstance(payload, basestring):
+            return None
+        return cls, self._digest(payload), options
+
+    def _get(self, key):
+        instance = self._instances.get(key)
+        if instance is None or self.shared:
+            return instance
+        return instance._clone()
+
+    def _set(self, key, instance):
+        '''Caches ``instance`` and returns the instance to hand out.'''
+        if self.shared:
+            self._instances.set(key, instance)
+            return instance
+        self._instances.set(key, instance._clone())
+        return instance
+
+    def invalidate(self, cls=None, payload=None):
+        '''Removes the instances of ``cls`` (or of every class) decoded from
+        the JSON text ``payload`` (or from any text).
+
+        '''
+        if cls is None and payload is None:
+            self._instances.clear()
+            return
+        digest = None if payload is None else self._digest(payload)
+        for key in self._instances.keys():
+            if ((cls is None or key[0] is cls) and
+                    (digest is None or key[1] == digest)):
+                self._instances.delete(key)
+
+    def stats(self):
+        '''Returns the ``hits``, ``misses`` and ``expired`` counts of the
+        cache, and its ``size`` and ``maxsize``.
+
+        '''
+        stats = self._instances.stats()
+        stats['expired'] = self._instances.expired
+        return stats
+
+    def __len__(self):
+        return len(self._instances)
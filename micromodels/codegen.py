@@ -0,0 +1,354 @@
+'''Generates the source of :class:`~micromodels.Model` classes from a JSON
+Schema or from sample documents.
+
+::
+
+    from micromodels import codegen
+
+    source = codegen.from_samples(documents, 'Tweet')
+    source = codegen.from_schema(json.load(open('tweet.schema.json')))
+
+or from the command line, printing the module to standard output::
+
+    python -m micromodels.codegen --name Tweet tweet1.json tweet2.json
+    python -m micromodels.codegen --schema tweet.schema.json
+
+The output is an ordinary module of model classes, so decoding with them
+is exactly as fast as with hand-written ones. Nested objects become
+:class:`~micromodels.ModelField` and
+:class:`~micromodels.ModelCollectionField` declarations of their own
+classes, keys which are not valid attribute names are mapped with
+``source``, and strings which all look like ISO 8601 dates or times become
+date and time fields. Values which are null in some documents, and whose
+field could not decode null, are kept as they are with
+:class:`~micromodels.BaseField`.
+
+'''
+import keyword
+import optparse
+import re
+import sys
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from .models import Model
+
+_DATETIME = re.compile(r'\d{4}-\d\d-\d\d[T ]\d\d:\d\d(:\d\d(\.\d+)?)?'
+                       r'(Z|[+-]\d\d:?\d\d)?\Z', re.I)
+_DATE = re.compile(r'\d{4}-\d\d-\d\d\Z')
+_TIME = re.compile(r'\d\d:\d\d:\d\d(\.\d+)?\Z')
+
+# Field declarations for scalar values. 'any' values are kept as they are.
+_SCALAR_FIELDS = {
+    'string': 'micromodels.CharField()',
+    'integer': 'micromodels.IntegerField()',
+    'number': 'micromodels.FloatField()',
+    'boolean': 'micromodels.BooleanField()',
+    'date-time': 'micromodels.DateTimeField()',
+    'date': "micromodels.DateField('%Y-%m-%d')",
+    'time': 'micromodels.TimeField()',
+    'any': 'micromodels.BaseField()',
+}
+
+# Merging two scalar kinds gives the first kind that covers both.
+_WIDENINGS = {
+    frozenset(['integer', 'number']): 'number',
+    frozenset(['date', 'date-time']): 'date-time',
+    frozenset(['string', 'date']): 'string',
+    frozenset(['string', 'date-time']): 'string',
+    frozenset(['string', 'time']): 'string',
+}
+
+
+class _ModelShape(object):
+    '''The inferred fields of a model: source keys in the order they were
+    first seen, the shape of each value and the keys which may be null.
+    Other shapes are scalar kinds (strings), ``('list', shape, nullable)``
+    for lists whose items may be null if ``nullable`` is true, or ``None``
+    when nothing is known.
+
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.keys = []
+        self.shapes = {}
+        self.nullable = set()
+
+    def add(self, key, shape, nullable=False):
+        if shape is None or nullable:
+            self.nullable.add(key)
+        if key not in self.shapes:
+            self.keys.append(key)
+            self.shapes[key] = shape
+        else:
+            self.shapes[key] = _merge(self.shapes[key], shape)
+
+
+def _merge(first, second):
+    '''Returns a shape which covers both ``first`` and ``second``.'''
+    if first is None:
+        return second
+    if second is None or first == second:
+        return first
+    if isinstance(first, _ModelShape) and isinstance(second, _ModelShape):
+        for key in second.keys:
+            first.add(key, second.shapes[key], key in second.nullable)
+        return first
+    if (isinstance(first, tuple) and isinstance(second, tuple)):
+        return ('list', _merge(first[1], second[1]), first[2] or second[2])
+    if isinstance(first, basestring) and isinstance(second, basestring):
+        return _WIDENINGS.get(frozenset([first, second]), 'any')
+    return 'any'
+
+
+def _sample_shape(value, name):
+    '''Infers the shape of one sample value.'''
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, long)):
+        return 'integer'
+    if isinstance(value, float):
+        return 'number'
+    if isinstance(value, basestring):
+        if _DATE.match(value):
+            return 'date'
+        if _DATETIME.match(value):
+            return 'date-time'
+        if _TIME.match(value):
+            return 'time'
+        return 'string'
+    if isinstance(value, dict):
+        shape = _ModelShape(name)
+        for key, item in sorted(value.items()):
+            shape.add(key, _sample_shape(item, key))
+        return shape
+    if isinstance(value, list):
+        items = None
+        for item in value:
+            items = _merge(items, _sample_shape(item, _singular(name)))
+        return ('list', items, None in value)
+    return 'any'
+
+
+def _takes_null(shape):
+    '''Returns ``True`` if the field declared for a value of ``shape`` can
+    also decode ``null``.
+
+    '''
+    if isinstance(shape, tuple):
+        return not isinstance(shape[1], _ModelShape)
+    return shape not in ('date', 'time')
+
+
+def _schema_nullable(schema):
+    kind = schema.get('type') if isinstance(schema, dict) else None
+    return kind == 'null' or isinstance(kind, list) and 'null' in kind
+
+
+def _schema_shape(schema, name, root, definitions):
+    '''Translates a JSON Schema into a shape. ``definitions`` caches the
+    shapes of ``$ref`` targets, so that each becomes a single class.
+
+    '''
+    if not isinstance(schema, dict):
+        return 'any'
+    ref = schema.get('$ref')
+    if ref is not None:
+        if ref not in definitions:
+            if not ref.startswith('#/'):
+                raise ValueError('Only local $refs are supported: %r' % ref)
+            target = root
+            for part in ref[2:].split('/'):
+                target = target[part]
+            definitions[ref] = None
+            definitions[ref] = _schema_shape(
+                target, target.get('title', ref.rsplit('/', 1)[-1]), root,
+                definitions)
+        if definitions[ref] is None:
+            raise ValueError('Recursive $refs are not supported: %r' % ref)
+        return definitions[ref]
+    kind = schema.get('type')
+    if isinstance(kind, list):
+        kinds = [k for k in kind if k != 'null']
+        kind = kinds[0] if len(kinds) == 1 else None
+    if kind is None and 'properties' in schema:
+        kind = 'object'
+    if kind == 'object':
+        shape = _ModelShape(schema.get('title', name))
+        for key, value in sorted(schema.get('properties', {}).items()):
+            shape.add(key, _schema_shape(value, key, root, definitions),
+                      _schema_nullable(value))
+        return shape
+    if kind == 'array':
+        items = schema.get('items', {})
+        return ('list', _schema_shape(items, _singular(name), root,
+                                      definitions), _schema_nullable(items))
+    if kind == 'string':
+        format = schema.get('format')
+        return format if format in ('date-time', 'date', 'time') else 'string'
+    if kind in ('integer', 'number', 'boolean'):
+        return kind
+    return 'any'
+
+
+def _singular(name):
+    if name.endswith('ies'):
+        return name[:-3] + 'y'
+    if name.endswith('s') and not name.endswith('ss'):
+        return name[:-1]
+    return name + '_item'
+
+
+def _class_name(name):
+    words = re.findall(r'[A-Za-z0-9]+', name)
+    name = ''.join(word[0].upper() + word[1:] for word in words) or 'Model'
+    if name[0].isdigit():
+        name = 'Model' + name
+    return name
+
+
+def _attribute_name(key):
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', key).lower()
+    name = re.sub(r'\W+', '_', name).strip('_') or 'field'
+    if name[0].isdigit():
+        name = 'field_' + name
+    if keyword.iskeyword(name) or hasattr(Model, name):
+        name += '_'
+    return name
+
+
+def _literal(key):
+    try:
+        return repr(str(key))
+    except UnicodeEncodeError:
+        return repr(key)
+
+
+class _Writer(object):
+    '''Writes the classes for a tree of shapes, nested classes first.'''
+
+    def __init__(self):
+        self.blocks = []
+        self.names = {}
+
+    def write(self, shape):
+        if id(shape) in self.names:
+            return self.names[id(shape)]
+        name = base = _class_name(shape.name)
+        taken = set(self.names.values())
+        number = 2
+        while name in taken:
+            name = '%s%d' % (base, number)
+            number += 1
+        self.names[id(shape)] = name
+        lines = ['class %s(micromodels.Model):' % name]
+        used = set()
+        for key in shape.keys:
+            attribute = _attribute_name(key)
+            while attribute in used:
+                attribute += '_'
+            used.add(attribute)
+            declaration = self.declaration(shape.shapes[key],
+                                           key in shape.nullable)
+            if attribute != key:
+                source = 'source=%s)' % _literal(key)
+                if not declaration.endswith('()'):
+                    source = ', ' + source
+                declaration = declaration[:-1] + source
+            lines.append('    %s = %s' % (attribute, declaration))
+        if len(lines) == 1:
+            lines.append('    pass')
+        self.blocks.append('\n'.join(lines))
+        return name
+
+    def declaration(self, shape, nullable=False):
+        # Values which may be null but whose field cannot decode null are
+        # kept as they are.
+        if nullable and not _takes_null(shape):
+            return _SCALAR_FIELDS['any']
+        if isinstance(shape, _ModelShape):
+            return 'micromodels.ModelField(%s)' % self.write(shape)
+        if isinstance(shape, tuple):
+            items = shape[1]
+            if shape[2] and (isinstance(items, _ModelShape) or
+                             not _takes_null(items)):
+                return ('micromodels.FieldCollectionField(%s)'
+                        % _SCALAR_FIELDS['any'])
+            if isinstance(items, _ModelShape):
+                return ('micromodels.ModelCollectionField(%s)'
+                        % self.write(items))
+            return ('micromodels.FieldCollectionField(%s)'
+                    % _SCALAR_FIELDS[items or 'any'])
+        return _SCALAR_FIELDS[shape or 'any']
+
+
+def _module(shape, origin):
+    if not isinstance(shape, _ModelShape):
+        raise ValueError('The documents must be JSON objects')
+    writer = _Writer()
+    writer.write(shape)
+    header = ['# Generated by micromodels.codegen from %s.' % origin,
+              'import micromodels']
+    return '\n\n\n'.join(['\n'.join(header)] + writer.blocks) + '\n'
+
+
+def from_samples(samples, name='Model'):
+    '''Returns the source of a module of model classes which can decode every
+    document in ``samples``, a sequence of decoded JSON objects. The class
+    for the documents themselves is called ``name``.
+
+    '''
+    shape = None
+    for sample in samples:
+        shape = _merge(shape, _sample_shape(sample, name))
+    return _module(shape, 'sample documents')
+
+
+def from_schema(schema, name=None):
+    '''Returns the source of a module of model classes for the decoded JSON
+    Schema ``schema``, which must describe an object. The class for it is
+    called ``name``, or after the schema's title.
+
+    '''
+    shape = _schema_shape(schema, name or 'Model', schema, {})
+    if name is not None and isinstance(shape, _ModelShape):
+        shape.name = name
+    return _module(shape, 'a JSON Schema')
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(
+        usage='%prog [options] FILE...',
+        description='Prints a module of micromodels classes for the JSON '
+                    'documents in FILE (each an object or an array of '
+                    'objects), or for the JSON Schema in FILE.')
+    parser.add_option('-s', '--schema', action='store_true',
+                      help='FILE is a JSON Schema')
+    parser.add_option('-n', '--name', help='name of the outermost class')
+    options, paths = parser.parse_args(argv)
+    if not paths:
+        parser.error('no input files')
+    documents = []
+    for path in paths:
+        with open(path) as input:
+            document = json.load(input)
+        if isinstance(document, list) and not options.schema:
+            documents.extend(document)
+        else:
+            documents.append(document)
+    if options.schema:
+        if len(documents) != 1:
+            parser.error('--schema takes a single file')
+        source = from_schema(documents[0], options.name)
+    else:
+        source = from_samples(documents, options.name or 'Model')
+    sys.stdout.write(source)
+
+
+if __name__ == '__main__':
+    main()
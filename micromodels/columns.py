@@ -0,0 +1,262 @@
+'''Column-oriented storage for large collections of small models.'''
+from array import array
+
+from .fields import (BooleanField, CharField, FloatField, IntegerField,
+                     _behaves_like, _converter)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_missing = object()
+
+# Fields whose values are stored in typed arrays, and their typecodes.
+_ARRAY_TYPES = ((IntegerField, 'l'), (FloatField, 'd'), (BooleanField, 'b'))
+
+
+class _Column(object):
+    __slots__ = ('name', 'key', 'field', 'convert', 'values', 'missing',
+                 'typecode', 'interned')
+
+    def __init__(self, key, field, name):
+        self.name = name
+        self.key = key
+        self.field = field
+        self.missing = None
+        self.typecode = None
+        self.interned = None
+        for field_class, typecode in _ARRAY_TYPES:
+            if (isinstance(field, field_class) and
+                    _behaves_like(type(field), field_class)):
+                self.typecode = typecode
+                self.values = array(typecode)
+                break
+        else:
+            self.values = []
+            if isinstance(field, CharField) and _behaves_like(type(field),
+                                                              CharField):
+                self.interned = {}
+        if self.typecode is not None or self.interned is not None:
+            self.convert = _converter(field)
+        else:
+            # Other values are kept as they are, and converted when a row is
+            # built so that they get the row as their context.
+            self.convert = None
+
+    def append(self, value, index):
+        if value is _missing:
+            if self.missing is None:
+                self.missing = set()
+            self.missing.add(index)
+            value = None if self.typecode is None else 0
+        elif self.convert is not None:
+            value = self.convert(value)
+            if self.interned is not None:
+                value = self.interned.setdefault(value, value)
+            elif self.typecode is not None:
+                try:
+                    self.values.append(value)
+                    return
+                except OverflowError:
+                    # Too big for a C long; fall back to a list.
+                    self.values = list(self.values)
+                    self.typecode = None
+        self.values.append(value)
+
+    def extend(self, values, start):
+        '''Appends a list of source values for rows ``start`` onwards.'''
+        if _missing in values:
+            for offset, value in enumerate(values):
+                self.append(value, start + offset)
+            return
+        # Values which are already of the field's own type need no conversion.
+        if (self.convert is not None and
+                not set(map(type, values)) <= set(self.field._serial_types)):
+            values = map(self.convert, values)
+        if self.interned is not None:
+            values = map(self.interned.setdefault, values, values)
+        elif self.typecode is not None:
+            try:
+                values = array(self.typecode, values)
+            except OverflowError:
+                self.values = list(self.values)
+                self.typecode = None
+        self.values.extend(values)
+
+    def get(self, index, context):
+        '''Returns the Python value of this column for row ``index``.'''
+        value = self.values[index]
+        if self.typecode == 'b':
+            return bool(value)
+        if self.convert is None:
+            return _converter(self.field)(value, context)
+        return value
+
+
+class ModelCollectionList(object):
+    """A read-only sequence of model instances which stores each field of the
+    model as a column: integer, float and boolean fields in
+    :class:`array.array` objects, and string fields in lists in which equal
+    strings are shared.
+
+    Rows are only built as model instances when they are indexed or iterated
+    over, so holding a large collection takes far less memory than a list of
+    instances. A whole column can be read with :meth:`column`, or exported to
+    NumPy with :meth:`to_numpy`.
+
+    """
+    def __init__(self, model_class, items=(), related_name=None,
+                 related_obj=None):
+        self.model_class = model_class
+        self._related_name = related_name
+        self._related_obj = related_obj
+        self._length = 0
+        self._columns = [_Column(key, field, name)
+                         for key, field, name in model_class._plan]
+        self._columns_by_name = dict((column.name, column)
+                                     for column in self._columns)
+        self.extend(items)
+
+    def append(self, item):
+        '''Adds a row, given either as a source dictionary or as an instance
+        of the model class.
+
+        '''
+        index = self._length
+        if isinstance(item, self.model_class):
+            for column in self._columns:
+                column.append(getattr(item, column.name, _missing), index)
+        else:
+            for column in self._columns:
+                column.append(item.get(column.key, _missing), index)
+        self._length += 1
+
+    def extend(self, items):
+        '''Adds a row for each source dictionary or model instance in
+        ``items``. Source dictionaries are converted a column at a time.
+
+        '''
+        items = list(items)
+        model_class = self.model_class
+        if any(isinstance(item, model_class) for item in items):
+            for item in items:
+                self.append(item)
+            return
+        start = self._length
+        for column in self._columns:
+            key = column.key
+            column.extend([item.get(key, _missing) for item in items], start)
+        self._length += len(items)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in xrange(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('ModelCollectionList index out of range')
+        return self._row(index)
+
+    def __iter__(self):
+        for index in xrange(self._length):
+            yield self._row(index)
+
+    def __repr__(self):
+        return '<ModelCollectionList of %d %s>' % (self._length,
+                                                   self.model_class.__name__)
+
+    def _row(self, index):
+        row = self.model_class()
+        store = object.__setattr__
+        for column in self._columns:
+            if column.missing is None or index not in column.missing:
+                store(row, column.name, column.get(index, row))
+        if self._related_name is not None:
+            setattr(row, self._related_name, self._related_obj)
+        return row
+
+    def column(self, name):
+        '''Returns the values of field ``name`` for every row. Integer, float
+        and boolean fields are returned as the underlying
+        :class:`array.array`, and must not be modified. Rows that have no
+        value for the field hold ``0`` or ``None``.
+
+        '''
+        column = self._columns_by_name[name]
+        if column.convert is not None:
+            return column.values
+        missing = column.missing or ()
+        return [None if index in missing else column.get(index, None)
+                for index in xrange(self._length)]
+
+    def to_numpy(self, name):
+        '''Returns the values of field ``name`` as a NumPy array. Requires
+        NumPy to be installed.
+
+        '''
+        if numpy is None:
+            raise ImportError('NumPy is required for to_numpy()')
+        column = self._columns_by_name[name]
+        if column.typecode == 'b':
+            return numpy.array(column.values, dtype=bool)
+        return numpy.array(self.column(name))
+
+    def __getstate__(self):
+        # Columns hold their fields' bound convert methods, so the list is
+        # pickled as its rows and built again when it is unpickled.
+        return {'model_class': self.model_class,
+                'related_name': self._related_name,
+                'related_obj': self._related_obj,
+                'rows': self._source_rows()}
+
+    def __setstate__(self, state):
+        self.__init__(state['model_class'], state['rows'],
+                      state['related_name'], state['related_obj'])
+
+    def _clone(self, memo):
+        '''Returns a copy for :meth:`~micromodels.Model._clone`, built
+        from the rows of this list, whose related object becomes its clone
+        if it has one in ``memo``.
+
+        '''
+        return ModelCollectionList(
+            self.model_class, self._source_rows(), self._related_name,
+            memo.get(id(self._related_obj), self._related_obj))
+
+    def _source_rows(self):
+        '''Returns a source dictionary for each row, holding the values as
+        stored, so that a list built from them needs no conversion.
+
+        '''
+        rows = []
+        for index in xrange(self._length):
+            row = {}
+            for column in self._columns:
+                if column.missing is not None and index in column.missing:
+                    continue
+                value = column.values[index]
+                if column.typecode == 'b':
+                    value = bool(value)
+                row[column.key] = value
+            rows.append(row)
+        return rows
+
+    def to_serial(self):
+        '''Serializes every row without building the model instances.'''
+        rows = []
+        for index in xrange(self._length):
+            row = {}
+            for column in self._columns:
+                if column.missing is not None and index in column.missing:
+                    continue
+                if column.convert is None:
+                    value = column.field.raw_to_serial(column.values[index])
+                else:
+                    value = column.field.to_serial(column.get(index, None))
+                row[column.name] = value
+            rows.append(row)
+        return rows
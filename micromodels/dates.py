@@ -0,0 +1,137 @@
+'''Date and time parsing for the datetime fields.
+
+The common ISO 8601 shapes (``YYYY-MM-DD``, optionally followed by
+``THH:MM:SS``, six fractional digits and a ``Z`` or ``+HH:MM`` offset) are
+parsed with a single regular expression. Anything else is handed to
+:mod:`PySO8601`, so results are always the same as it would give.
+
+:class:`FormatParser` does the same for ``strptime`` formats: formats made
+only of numeric directives are compiled to a regular expression once, and
+other formats fall back to :meth:`datetime.datetime.strptime`.
+
+'''
+import datetime
+import re
+
+import PySO8601
+
+_ISO_DATETIME = re.compile(r'\s*(\d{4})-(\d\d)-(\d\d)'
+                           r'(?:[T ](\d\d):(\d\d):(\d\d)(?:\.(\d{6}))?'
+                           r'(Z|[+-]\d\d:\d\d)?)?\s*\Z', re.I)
+_ISO_TIME = re.compile(r'\s*(\d\d):(\d\d):(\d\d)(?:\.(\d{6}))?'
+                       r'(?:Z|[+-]\d\d:\d\d)?\s*\Z', re.I)
+
+_timezones = {}
+
+
+def _timezone(offset):
+    '''Returns a shared :class:`PySO8601.Timezone` for ``offset``.'''
+    offset = offset.upper()
+    try:
+        return _timezones[offset]
+    except KeyError:
+        return _timezones.setdefault(offset, PySO8601.Timezone(offset))
+
+
+def parse_datetime(value):
+    '''Parses an ISO 8601 date or datetime string into a
+    :class:`datetime.datetime`.
+
+    '''
+    match = _ISO_DATETIME.match(value)
+    if match is None:
+        return PySO8601.parse(value)
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    if hour is None:
+        return datetime.datetime(int(year), int(month), int(day))
+    return datetime.datetime(int(year), int(month), int(day),
+                             int(hour), int(minute), int(second),
+                             int(fraction or 0),
+                             offset and _timezone(offset))
+
+
+def parse_time(value):
+    '''Parses an ISO 8601 time string into a :class:`datetime.time`.'''
+    match = _ISO_TIME.match(value)
+    if match is None:
+        return PySO8601.parse_time(value).time()
+    hour, minute, second, fraction = match.groups()
+    return datetime.time(int(hour), int(minute), int(second),
+                         int(fraction or 0))
+
+
+# The same patterns as time.strptime uses for these directives.
+_DIRECTIVES = {
+    'd': r'(?P<d>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])',
+    'f': r'(?P<f>[0-9]{1,6})',
+    'H': r'(?P<H>2[0-3]|[0-1]\d|\d)',
+    'm': r'(?P<m>1[0-2]|0[1-9]|[1-9])',
+    'M': r'(?P<M>[0-5]\d|\d)',
+    'S': r'(?P<S>6[0-1]|[0-5]\d|\d)',
+    'y': r'(?P<y>\d\d)',
+    'Y': r'(?P<Y>\d\d\d\d)',
+}
+_FORMAT_TOKEN = re.compile(r'%(.)|(\s+)|([^%\s]+)', re.S)
+
+
+def _compile_format(format):
+    '''Translates a ``strptime`` format into a regular expression, or returns
+    ``None`` if it uses directives which are not handled here.
+
+    '''
+    pattern = []
+    seen = set()
+    end = 0
+    for token in _FORMAT_TOKEN.finditer(format):
+        if token.start() != end:
+            return None
+        end = token.end()
+        directive, space, literal = token.groups()
+        if directive:
+            if directive == '%':
+                pattern.append('%')
+            elif directive in _DIRECTIVES and directive not in seen:
+                seen.add(directive)
+                pattern.append(_DIRECTIVES[directive])
+            else:
+                return None
+        elif space:
+            pattern.append(r'\s+')
+        else:
+            pattern.append(re.escape(literal))
+    if end != len(format):
+        return None
+    return re.compile(''.join(pattern) + r'\Z', re.I)
+
+
+class FormatParser(object):
+    """Parses strings in a fixed ``strptime`` format into
+    :class:`datetime.datetime` objects.
+
+    """
+    def __init__(self, format):
+        self.format = format
+        self.regex = _compile_format(format)
+
+    def __call__(self, value):
+        if self.regex is None:
+            return datetime.datetime.strptime(value, self.format)
+        match = self.regex.match(value)
+        if match is None:
+            raise ValueError('time data %r does not match format %r'
+                             % (value, self.format))
+        found = match.groupdict()
+        if 'Y' in found:
+            year = int(found['Y'])
+        elif 'y' in found:
+            year = int(found['y'])
+            year += 2000 if year < 69 else 1900
+        else:
+            year = 1900
+        fraction = found.get('f')
+        return datetime.datetime(year, int(found.get('m', 1)),
+                                 int(found.get('d', 1)),
+                                 int(found.get('H', 0)),
+                                 int(found.get('M', 0)),
+                                 int(found.get('S', 0)),
+                                 int(fraction.ljust(6, '0')) if fraction else 0)
@@ -0,0 +1,207 @@
+'''Writes models out as JSON in a single pass over the model tree.
+
+Nested models are written directly rather than being turned into
+dictionaries first, and the output goes straight to a ``write`` callable,
+usually the ``write`` method of a file-like object. The output decodes to
+the same value as :meth:`~micromodels.Model.to_dict` with ``serial=True``.
+
+This is several times faster than ``json.dump``, which encodes in pure
+Python when writing to a file. When the whole string is wanted anyway,
+``json.dumps`` of the dictionary is still a little faster, since its
+encoder is written in C.
+
+'''
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from .fields import (BaseField, ModelField, ModelCollectionField,
+                     _behaves_like, _defining_class, _ordered)
+
+_encode_json = json.JSONEncoder().encode
+_encode_string = json.encoder.encode_basestring_ascii
+_missing = object()
+
+# How the value of a field is written.
+_SCALAR, _SERIAL, _MODEL, _MODELS = range(4)
+
+
+def _encode(value):
+    '''Encodes a serialized value, going straight to the C string encoder
+    for the most common types.
+
+    '''
+    kind = type(value)
+    if kind is unicode or kind is str:
+        return _encode_string(value)
+    if kind is int or kind is long:
+        return str(value)
+    if kind is float and value - value == 0:
+        return repr(value)
+    if kind is bool:
+        return 'true' if value else 'false'
+    if value is None:
+        return 'null'
+    return _encode_json(value)
+
+
+def compile_plan(fields):
+    '''Returns the encoding plan for a field table: the attribute name, the
+    field, the text written before the value and how to write the value.
+
+    '''
+    plan = []
+    for name, field in _ordered(fields):
+        cls = type(field)
+        if (isinstance(field, ModelField) and
+                _behaves_like(cls, ModelField)):
+            kind = _MODEL
+        elif (isinstance(field, ModelCollectionField) and
+                _behaves_like(cls, ModelCollectionField)):
+            kind = _MODELS
+        elif _defining_class(cls, 'to_serial') is BaseField:
+            kind = _SCALAR
+        else:
+            kind = _SERIAL
+        plan.append((name, field, _encode_string(name) + ': ', kind))
+    return tuple(plan)
+
+
+def _plan_and_getter(instance):
+    '''Returns the encoding plan for ``instance`` and a ``get(name,
+    default)`` callable for its converted values.
+
+    '''
+    cls = type(instance)
+    fields = instance._fields
+    if fields is cls._clsfields:
+        plan = cls._json_plan
+    else:
+        plan = compile_plan(fields)
+    # Compact models keep their values in slots; asking for their __dict__
+    # would allocate it. Otherwise a value missing from the __dict__ is
+    # either still raw or was never set.
+    if cls.__compact__:
+        get = lambda name, default: getattr(instance, name, default)
+    else:
+        get = instance.__dict__.get
+    return plan, get
+
+
+def write_model(instance, write):
+    '''Writes ``instance`` as a JSON object with ``write``.'''
+    plan, get = _plan_and_getter(instance)
+    raw = instance._raw
+    parts = []
+    append = parts.append
+    separator = '{'
+    for name, field, key, kind in plan:
+        if raw and name in raw:
+            append(separator + key + _encode(field.raw_to_serial(raw[name])))
+            separator = ', '
+            continue
+        value = get(name, _missing)
+        if value is _missing:
+            continue
+        if kind is _SCALAR:
+            value_type = type(value)
+            if value_type is unicode or value_type is str:
+                append(separator + key + _encode_string(value))
+            elif value_type is int:
+                append(separator + key + str(value))
+            else:
+                append(separator + key + _encode(value))
+        elif kind is _SERIAL:
+            append(separator + key +
+                   _encode(instance._serial_value(name, field, value)))
+        elif kind is _MODEL and hasattr(value, '_fields'):
+            append(separator + key)
+            write(''.join(parts))
+            del parts[:]
+            write_model(value, write)
+        elif kind is _MODELS and hasattr(value, 'to_serial'):
+            # Lazy and columnar lists serialize without building instances.
+            append(separator + key + _encode(value.to_serial()))
+        elif kind is _MODELS:
+            append(separator + key)
+            write(''.join(parts))
+            del parts[:]
+            write_models(value, write)
+        else:
+            append(separator + key + _encode(field.to_serial(value)))
+        separator = ', '
+    append('{}' if separator == '{' else '}')
+    write(''.join(parts))
+
+
+def write_models(instances, write):
+    '''Writes an iterable of models as a JSON array with ``write``.'''
+    separator = '['
+    for instance in instances:
+        write(separator)
+        write_model(instance, write)
+        separator = ', '
+    write('[]' if separator == '[' else ']')
+
+
+def _model_json(instance):
+    parts = []
+    write_model(instance, parts.append)
+    return ''.join(parts)
+
+
+def iter_model(instance, slice_size):
+    '''Yields the JSON for ``instance`` in pieces, so that producing each
+    piece only takes a bounded amount of work. Lists of models, converted
+    or still raw, are written ``slice_size`` items per piece, and nested
+    models are written piece by piece as well. Other values are written
+    whole.
+
+    '''
+    plan, get = _plan_and_getter(instance)
+    raw = instance._raw
+    parts = []
+    append = parts.append
+    separator = '{'
+    for name, field, key, kind in plan:
+        if raw and name in raw:
+            value = raw[name]
+            if kind is not _MODELS or type(value) is not list:
+                append(separator + key + _encode(field.raw_to_serial(value)))
+                separator = ', '
+                continue
+            encode_item = lambda item: _encode(field._raw_item_to_serial(item))
+        else:
+            value = get(name, _missing)
+            if value is _missing:
+                continue
+            if kind is _MODEL and hasattr(value, '_fields'):
+                append(separator + key)
+                yield ''.join(parts)
+                del parts[:]
+                for piece in iter_model(value, slice_size):
+                    yield piece
+                separator = ', '
+                continue
+            if kind is not _MODELS or type(value) is not list:
+                if kind is _SERIAL:
+                    value = instance._serial_value(name, field, value)
+                elif kind is not _SCALAR:
+                    value = field.to_serial(value)
+                append(separator + key + _encode(value))
+                separator = ', '
+                continue
+            encode_item = _model_json
+        append(separator + key + '[')
+        for start in xrange(0, len(value), slice_size):
+            if start:
+                append(', ')
+            append(', '.join(map(encode_item,
+                                 value[start:start + slice_size])))
+            yield ''.join(parts)
+            del parts[:]
+        append(']')
+        separator = ', '
+    append('{}' if separator == '{' else '}')
+    yield ''.join(parts)
@@ -1,5 +1,114 @@
 import datetime
-import PySO8601
+import itertools
+import threading
+
+from . import dates
+from . import identity as _identity
+from .cache import LRUCache
+from .sequences import LazyList
+
+
+_legacy_lock = threading.RLock()
+_legacy_classes = {}
+_unchanged_classes = {}
+_missing = object()
+
+# Conversion results of these types can be shared, and so cached.
+_immutable_types = frozenset([unicode, str, int, long, float, bool,
+                              type(None), datetime.datetime, datetime.date,
+                              datetime.time])
+
+
+def _defining_class(cls, name):
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass
+
+
+def _is_legacy(cls):
+    '''A field class is "legacy" when it overrides :meth:`BaseField.to_python`
+    or :meth:`BaseField.populate` more recently than :meth:`BaseField.convert`.
+
+    '''
+    try:
+        return _legacy_classes[cls]
+    except KeyError:
+        convert = _defining_class(cls, 'convert')
+        legacy = False
+        for name in ('to_python', 'populate'):
+            klass = _defining_class(cls, name)
+            if klass is not convert and issubclass(klass, convert):
+                legacy = True
+        _legacy_classes[cls] = legacy
+        return legacy
+
+
+def _behaves_like(cls, base):
+    '''Returns ``True`` if ``cls`` converts and serializes values exactly as
+    its ancestor ``base`` does.
+
+    '''
+    try:
+        return _unchanged_classes[cls, base]
+    except KeyError:
+        unchanged = all(issubclass(base, _defining_class(cls, name))
+                        for name in ('convert', 'to_python', 'populate',
+                                     'to_serial'))
+        _unchanged_classes[cls, base] = unchanged
+        return unchanged
+
+
+def _converter(field):
+    '''Returns a ``convert(value, context)`` callable for ``field``.
+
+    Fields which only implement the older :meth:`~BaseField.populate` /
+    :meth:`~BaseField.to_python` pair are still supported, but since they
+    convert through state stored on the field, their conversions are
+    serialized behind a lock.
+
+    '''
+    if not _is_legacy(type(field)):
+        convert = field.convert
+    else:
+        def convert(value, context=None):
+            with _legacy_lock:
+                field.populate(value)
+                field._related_obj = context
+                return field.to_python()
+    if field.cache is None:
+        return convert
+    return _cached(convert, field.cache)
+
+
+def _ordered(fields):
+    '''Returns the ``(name, field)`` pairs of a field table in the order in
+    which the fields were declared.
+
+    '''
+    return sorted(fields.iteritems(),
+                  key=lambda item: (item[1]._order, item[0]))
+
+
+def _cached(convert, cache):
+    '''Wraps ``convert`` so that immutable results are memoized in ``cache``,
+    keyed by the type and value of the source value.
+
+    '''
+    get = cache.get
+    store = cache.set
+
+    def cached_convert(value, context=None):
+        key = (type(value), value)
+        try:
+            result = get(key, _missing)
+        except TypeError:
+            return convert(value, context)
+        if result is _missing:
+            result = convert(value, context)
+            if type(result) in _immutable_types:
+                store(key, result)
+        return result
+    return cached_convert
 
 
 class BaseField(object):
@@ -9,9 +118,28 @@ class BaseField(object):
     data. If ``source`` is not specified, the field instance will use its own
     name as the key to retrieve the value from the source data.
 
+    The ``cache_size`` parameter memoizes the conversions made by models for
+    up to that many distinct source values. Only hashable source values
+    whose converted value is immutable (strings, numbers, dates and times)
+    are cached. The cache is available as the ``cache`` attribute, and keeps
+    ``hits`` and ``misses`` counters.
+
     """
-    def __init__(self, source=None):
+    # Types of source values that this field serializes back unchanged.
+    _serial_types = ()
+
+    # Counts field instances as they are created, so that the fields of a
+    # model can be kept in the order they were declared in.
+    _creation_counter = itertools.count()
+    _order = 0
+
+    cache = None
+
+    def __init__(self, source=None, cache_size=None):
+        self._order = next(BaseField._creation_counter)
         self.source = source
+        if cache_size:
+            self.cache = LRUCache(cache_size)
 
     def populate(self, data):
         """Set the value or values wrapped by this field"""
@@ -20,11 +148,23 @@ class BaseField(object):
 
     def to_python(self):
         '''After being populated, this method casts the source data into a
-        Python object. The default behavior is to simply return the source
-        value. Subclasses should override this method.
+        Python object using :meth:`convert`, with the model the field is
+        being converted for as the context.
+
+        '''
+        return self.convert(self.data, getattr(self, '_related_obj', None))
+
+    def convert(self, value, context=None):
+        '''Casts ``value`` into a Python object. The default behavior is to
+        simply return the source value. Subclasses should override this
+        method.
+
+        ``context`` is the :class:`~micromodels.Model` instance the value is
+        being set on, if any. This method must not store anything on the
+        field, as a field instance is shared by every instance of its model.
 
         '''
-        return self.data
+        return value
 
     def to_serial(self, data):
         '''Used to serialize forms back into JSON or other formats.
@@ -37,59 +177,70 @@ class BaseField(object):
         '''
         return data
 
+    def raw_to_serial(self, value):
+        '''Serializes a source value which has not been converted. This is
+        equivalent to ``to_serial(convert(value))``, but source values which
+        would come back unchanged are returned as they are.
+
+        '''
+        cls = type(self)
+        if (type(value) in self._serial_types and
+                _behaves_like(cls, _defining_class(cls, '_serial_types'))):
+            return value
+        return self.to_serial(_converter(self)(value))
+
 
 class CharField(BaseField):
     """Field to represent a simple Unicode string value."""
 
-    def to_python(self):
-        """Convert the data supplied using the :meth:`populate` method to a
-        Unicode string.
+    _serial_types = (unicode,)
 
-        """
-        if self.data is None:
+    def convert(self, value, context=None):
+        """Convert the data supplied to a Unicode string."""
+        if value is None:
             return ''
-        return unicode(self.data)
+        return unicode(value)
 
 
 class IntegerField(BaseField):
     """Field to represent an integer value"""
 
-    def to_python(self):
-        """Convert the data supplied to the :meth:`populate` method to an
-        integer.
+    _serial_types = (int, long)
 
-        """
-        if self.data is None:
+    def convert(self, value, context=None):
+        """Convert the data supplied to an integer."""
+        if value is None:
             return 0
-        return int(self.data)
+        return int(value)
 
 
 class FloatField(BaseField):
     """Field to represent a floating point value"""
 
-    def to_python(self):
-        """Convert the data supplied to the :meth:`populate` method to a
-        float.
+    _serial_types = (float,)
 
-        """
-        if self.data is None:
+    def convert(self, value, context=None):
+        """Convert the data supplied to a float."""
+        if value is None:
             return 0.0
-        return float(self.data)
+        return float(value)
 
 
 class BooleanField(BaseField):
     """Field to represent a boolean"""
 
-    def to_python(self):
+    _serial_types = (bool,)
+
+    def convert(self, value, context=None):
         """The string ``'True'`` (case insensitive) will be converted
         to ``True``, as will any positive integers.
 
         """
-        if isinstance(self.data, basestring):
-            return self.data.strip().lower() == 'true'
-        if isinstance(self.data, int):
-            return self.data > 0
-        return bool(self.data)
+        if isinstance(value, basestring):
+            return value.strip().lower() == 'true'
+        if isinstance(value, int):
+            return value > 0
+        return bool(value)
 
 
 class DateTimeField(BaseField):
@@ -107,21 +258,22 @@ class DateTimeField(BaseField):
         super(DateTimeField, self).__init__(**kwargs)
         self.format = format
         self.serial_format = serial_format
+        self._parser = format and dates.FormatParser(format)
 
-    def to_python(self):
+    def convert(self, value, context=None):
         '''A :class:`datetime.datetime` object is returned.'''
 
-        if self.data is None:
+        if value is None:
             return None
 
         # don't parse data that is already native
-        if isinstance(self.data, datetime.datetime):
-            return self.data
+        if isinstance(value, datetime.datetime):
+            return value
         elif self.format is None:
             # parse as iso8601
-            return PySO8601.parse(self.data)
+            return dates.parse_datetime(value)
         else:
-            return datetime.datetime.strptime(self.data, self.format)
+            return self._parser(value)
 
     def to_serial(self, time_obj):
         if not self.serial_format:
@@ -131,27 +283,27 @@ class DateTimeField(BaseField):
 class DateField(DateTimeField):
     """Field to represent a :mod:`datetime.date`"""
 
-    def to_python(self):
+    def convert(self, value, context=None):
         # don't parse data that is already native
-        if isinstance(self.data, datetime.date):
-            return self.data
-        
-        dt = super(DateField, self).to_python()
+        if isinstance(value, datetime.date):
+            return value
+
+        dt = super(DateField, self).convert(value, context)
         return dt.date()
 
 
 class TimeField(DateTimeField):
     """Field to represent a :mod:`datetime.time`"""
 
-    def to_python(self):
+    def convert(self, value, context=None):
         # don't parse data that is already native
-        if isinstance(self.data, datetime.datetime):
-            return self.data
+        if isinstance(value, datetime.datetime):
+            return value
         elif self.format is None:
             # parse as iso8601
-            return PySO8601.parse_time(self.data).time()
+            return dates.parse_time(value)
         else:
-            return datetime.datetime.strptime(self.data, self.format).time()
+            return self._parser(value).time()
 
 
 class WrappedObjectField(BaseField):
@@ -160,7 +312,6 @@ class WrappedObjectField(BaseField):
     def __init__(self, wrapped_class, related_name=None, **kwargs):
         self._wrapped_class = wrapped_class
         self._related_name = related_name
-        self._related_obj = None
 
         BaseField.__init__(self, **kwargs)
 
@@ -199,22 +350,75 @@ class ModelField(WrappedObjectField):
         >>> m.second_item.nested_item
         u'Some nested value'
 
+    If the same nested object occurs many times, pass the name of a field
+    that identifies it as ``identity``. Nested objects with the same value
+    for that field are then decoded once and shared, within the current
+    :class:`~micromodels.identity.IdentityMap`. Shared objects cannot have a
+    ``related_name``.
+
     """
-    def to_python(self):
-        if isinstance(self.data, self._wrapped_class):
-            obj = self.data
+    def __init__(self, wrapped_class, related_name=None, identity=None,
+                 **kwargs):
+        if identity is not None:
+            if related_name is not None:
+                raise TypeError('A ModelField with an identity cannot have '
+                                'a related_name')
+            field = wrapped_class._clsfields.get(identity)
+            if field is None:
+                raise ValueError('%s has no field %r'
+                                 % (wrapped_class.__name__, identity))
+            self._identity_source = field.source or identity
+        self.identity = identity
+        WrappedObjectField.__init__(self, wrapped_class, related_name,
+                                    **kwargs)
+
+    def convert(self, value, context=None):
+        identity_map = self.identity and _identity.current()
+        if identity_map is not None:
+            obj = self._shared(identity_map, value)
+        elif isinstance(value, self._wrapped_class):
+            obj = value
         else:
-            obj = self._wrapped_class.from_dict(self.data or {})
+            obj = self._wrapped_class.from_dict(value or {})
 
         # Set the related object to the related field
         if self._related_name is not None:
-            setattr(obj, self._related_name, self._related_obj)
+            setattr(obj, self._related_name, context)
 
         return obj
 
+    def _shared(self, identity_map, value):
+        '''Returns the instance in ``identity_map`` for ``value``, decoding
+        and adding it first if there is none.
+
+        '''
+        cls = self._wrapped_class
+        if isinstance(value, cls):
+            key = getattr(value, self.identity, None)
+        else:
+            value = value or {}
+            key = value.get(self._identity_source)
+        if key is None:
+            return value if isinstance(value, cls) else cls.from_dict(value)
+        try:
+            obj = identity_map.get(cls, key)
+        except TypeError:
+            obj = key = None
+        if obj is None:
+            obj = value if isinstance(value, cls) else cls.from_dict(value)
+            if key is not None:
+                identity_map.add(cls, key, obj)
+        return obj
+
     def to_serial(self, model_instance):
         return model_instance.to_dict(serial=True)
 
+    def raw_to_serial(self, value):
+        if ((value is None or isinstance(value, dict)) and
+                _behaves_like(type(self), ModelField)):
+            return self._wrapped_class._raw_to_serial(value or {})
+        return super(ModelField, self).raw_to_serial(value)
+
 
 class ModelCollectionField(WrappedObjectField):
     """Field containing a list of model instances.
@@ -248,20 +452,61 @@ class ModelCollectionField(WrappedObjectField):
         >>> [item.value for item in m.list]
         [u'First value', u'Second value', u'Third value']
 
+    If ``columnar`` is ``True``, the list is returned as a
+    :class:`~micromodels.columns.ModelCollectionList`, which stores the
+    items column by column and only builds model instances when they are
+    indexed. This saves a great deal of memory and time for large
+    collections of small models.
+
+    If ``lazy`` is ``True``, the list is returned as a
+    :class:`~micromodels.sequences.LazyList`, which only converts each item
+    when it is first indexed or iterated over.
+
     """
-    def to_python(self):
-        object_list = []
-        for item in self.data:
+    def __init__(self, wrapped_class, columnar=False, lazy=False, **kwargs):
+        if columnar and lazy:
+            raise TypeError('a ModelCollectionField cannot be both columnar '
+                            'and lazy')
+        super(ModelCollectionField, self).__init__(wrapped_class, **kwargs)
+        self.columnar = columnar
+        self.lazy = lazy
+
+    def convert(self, value, context=None):
+        if self.columnar:
+            from .columns import ModelCollectionList
+            return ModelCollectionList(self._wrapped_class, value,
+                                       self._related_name, context)
+        if self.lazy:
+            return LazyList(self, value, context)
+        return [self._convert_item(item, context) for item in value]
+
+    def _convert_item(self, item, context):
+        if isinstance(item, self._wrapped_class):
+            obj = item
+        else:
             obj = self._wrapped_class.from_dict(item)
-            if self._related_name is not None:
-                setattr(obj, self._related_name, self._related_obj)
-            object_list.append(obj)
+        if self._related_name is not None:
+            setattr(obj, self._related_name, context)
+        return obj
 
-        return object_list
+    def _item_to_serial(self, instance):
+        return instance.to_dict(serial=True)
+
+    def _raw_item_to_serial(self, item):
+        if isinstance(item, dict):
+            return self._wrapped_class._raw_to_serial(item)
+        return item.to_dict(serial=True)
 
     def to_serial(self, model_instances):
+        if hasattr(model_instances, 'to_serial'):
+            return model_instances.to_serial()
         return [instance.to_dict(serial=True) for instance in model_instances]
 
+    def raw_to_serial(self, value):
+        if not _behaves_like(type(self), ModelCollectionField):
+            return super(ModelCollectionField, self).raw_to_serial(value)
+        return [self._raw_item_to_serial(item) for item in value]
+
 
 class FieldCollectionField(BaseField):
     """Field containing a list of the same type of fields.
@@ -326,16 +571,38 @@ class FieldCollectionField(BaseField):
         >>> f.to_json()
         '{"earthquake_dates": ["05-11-1906", "11-02-1948", "01-01-1970"], "name": "San Andreas"}'
 
+    As with :class:`~micromodels.ModelCollectionField`, passing
+    ``lazy=True`` returns a :class:`~micromodels.sequences.LazyList` which
+    only converts each item when it is first used.
+
     """
-    def __init__(self, field_instance, **kwargs):
+    def __init__(self, field_instance, lazy=False, **kwargs):
         super(FieldCollectionField, self).__init__(**kwargs)
         self._instance = field_instance
+        self.lazy = lazy
 
-    def to_python(self):
-        def convert(item):
-            self._instance.populate(item)
-            return self._instance.to_python()
-        return [convert(item) for item in self.data or []]
+    def convert(self, value, context=None):
+        if self.lazy:
+            return LazyList(self, value, context)
+        convert_item = _converter(self._instance)
+        return [convert_item(item, context) for item in value or []]
+
+    def _convert_item(self, item, context):
+        return _converter(self._instance)(item, context)
+
+    def _item_to_serial(self, value):
+        return self._instance.to_serial(value)
+
+    def _raw_item_to_serial(self, item):
+        return self._instance.raw_to_serial(item)
 
     def to_serial(self, list_of_fields):
+        if hasattr(list_of_fields, 'to_serial'):
+            return list_of_fields.to_serial()
         return [self._instance.to_serial(data) for data in list_of_fields]
+
+    def raw_to_serial(self, value):
+        if not _behaves_like(type(self), FieldCollectionField):
+            return super(FieldCollectionField, self).raw_to_serial(value)
+        raw_to_serial = self._instance.raw_to_serial
+        return [raw_to_serial(item) for item in value or []]
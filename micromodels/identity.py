@@ -0,0 +1,120 @@
+'''Identity maps, which let nested objects that occur many times in a
+document be decoded once and shared.
+
+A :class:`~micromodels.ModelField` declared with an ``identity`` looks up
+the nested object's value for that field in the current identity map, and
+reuses the instance decoded for it earlier instead of decoding another::
+
+    class Tweet(micromodels.Model):
+        text = micromodels.CharField()
+        user = micromodels.ModelField(TwitterUser, identity='id')
+
+An identity map is in effect for the whole of each call to
+:meth:`~micromodels.Model.from_dict`, :meth:`~micromodels.Model.from_dicts`
+and the stream decoding methods of a model which has such fields, directly
+or in its nested models. To share objects across several calls, make one
+identity map current for all of them::
+
+    with IdentityMap(max_size=50000):
+        tweets = [Tweet.from_dict(data) for data in timelines]
+
+Shared instances are the same object wherever they occur, so changing one
+changes all of them.
+
+'''
+import threading
+
+from .cache import LRUCache
+
+# The number of objects an identity map holds by default. Once it is full,
+# the least recently used ones are forgotten and decoded again if they
+# occur again.
+DEFAULT_MAX_SIZE = 10000
+
+_local = threading.local()
+
+
+def current():
+    '''Returns the identity map in effect in this thread, or ``None``.'''
+    return getattr(_local, 'map', None)
+
+
+class IdentityMap(object):
+    """Maps model classes and identity values to the instances decoded for
+    them, holding at most ``max_size`` instances. Using it in a ``with``
+    statement makes it the current identity map of the thread.
+
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self._objects = LRUCache(max_size)
+
+    def get(self, cls, key):
+        '''Returns the instance of ``cls`` with the identity ``key``, or
+        ``None``. Raises ``TypeError`` if ``key`` is not hashable.
+
+        '''
+        return self._objects.get((cls, key))
+
+    def add(self, cls, key, obj):
+        '''Stores ``obj`` as the instance of ``cls`` with the identity
+        ``key``.
+
+        '''
+        self._objects.set((cls, key), obj)
+
+    def stats(self):
+        '''Returns the number of lookups which found an instance
+        (``hits``) and which did not (``misses``), and the ``size`` and
+        ``maxsize`` of the map.
+
+        '''
+        return self._objects.stats()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __enter__(self):
+        previous = getattr(_local, 'previous', None)
+        if previous is None:
+            previous = _local.previous = []
+        previous.append(current())
+        _local.map = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.map = _local.previous.pop()
+
+
+def _scoped(cls, function, *args):
+    '''Calls ``function(*args)`` with an identity map in effect if ``cls``
+    shares objects and none is current.
+
+    '''
+    if not cls._shares_identity or current() is not None:
+        return function(*args)
+    with IdentityMap():
+        return function(*args)
+
+
+def _iter_scoped(cls, iterator):
+    '''Returns ``iterator`` with a single identity map in effect while each
+    of its items is produced, if ``cls`` shares objects. The map is the one
+    current at the time of the call, or a new one.
+
+    '''
+    if not cls._shares_identity:
+        return iterator
+    identity_map = current()
+    if identity_map is None:
+        identity_map = IdentityMap()
+    return _iter_in(identity_map, iterator)
+
+
+def _iter_in(identity_map, iterator):
+    while True:
+        with identity_map:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
@@ -0,0 +1,106 @@
+'''Cooperative decoding, for programs which cannot afford to block for as
+long as a large document takes to decode, such as event-driven servers.
+
+The work is done a slice at a time as the decoder is iterated over, so any
+event loop can drive it: for example with Twisted's
+``twisted.internet.task.cooperate``, or from a Tornado coroutine which
+yields ``gen.moment`` between steps.
+
+'''
+from .fields import (ModelField, ModelCollectionField, _behaves_like,
+                     _converter)
+from .models import _chunked, _decode_chunk, _rebuild
+
+
+class IncrementalDecode(object):
+    """Decodes the dictionary ``data`` into an instance of ``model_class``,
+    doing at most about ``slice_size`` conversions each time it is stepped.
+
+    Iterating over the decode does the work. The items of model collections
+    are converted ``slice_size`` at a time, nested models are decoded
+    incrementally as well, and any other value counts as a single
+    conversion. Once iteration is over, the instance is in :attr:`result`.
+
+    If ``executor`` is given, it must have a ``submit(fn, *args)`` method
+    returning a future, like the executors of :mod:`concurrent.futures`.
+    The chunks of model collections are then submitted to it, and the steps
+    which wait for a chunk yield its future. Drivers which can wait for a
+    future without blocking should do so before taking the next step;
+    otherwise the next step blocks until the chunk is ready. Every other
+    step yields ``None``. With a process pool, the model classes must be
+    importable by the workers.
+
+    """
+    def __init__(self, model_class, data, slice_size=500, executor=None):
+        if slice_size < 1:
+            raise ValueError('slice_size must be at least 1')
+        self.model_class = model_class
+        self.data = data
+        self.slice_size = slice_size
+        self.executor = executor
+        self.result = None
+
+    def __iter__(self):
+        return self._steps()
+
+    def _steps(self):
+        instance = self.model_class()
+        store = object.__setattr__
+        data = self.data
+        done = 0
+        for key, field, name in self.model_class._plan:
+            if key not in data:
+                continue
+            value = data[key]
+            cls = type(field)
+            if (type(value) is dict and isinstance(field, ModelField) and
+                    _behaves_like(cls, ModelField)):
+                nested = IncrementalDecode(field._wrapped_class, value,
+                                           self.slice_size, self.executor)
+                for step in nested:
+                    yield step
+                value = nested.result
+                if field._related_name is not None:
+                    setattr(value, field._related_name, instance)
+                done = 0
+            elif (type(value) is list and
+                    isinstance(field, ModelCollectionField) and
+                    _behaves_like(cls, ModelCollectionField) and
+                    not field.columnar and not field.lazy):
+                items = []
+                for step in self._collection(field, value, items, instance):
+                    yield step
+                value = items
+                done = 0
+            else:
+                value = _converter(field)(value, instance)
+                done += 1
+                if done >= self.slice_size:
+                    yield
+                    done = 0
+            store(instance, name, value)
+        self.result = instance
+
+    def _collection(self, field, value, items, instance):
+        '''Converts the items of a model collection into ``items``, yielding
+        after each slice.
+
+        '''
+        wrapped_class = field._wrapped_class
+        if (self.executor is None or
+                not all(type(item) is dict for item in value)):
+            convert = field._convert_item
+            for chunk in _chunked(value, self.slice_size):
+                items.extend([convert(item, instance) for item in chunk])
+                yield
+            return
+        submit = self.executor.submit
+        futures = [submit(_decode_chunk, (wrapped_class, chunk, False))
+                   for chunk in _chunked(value, self.slice_size)]
+        related_name = field._related_name
+        for future in futures:
+            yield future
+            for obj in _rebuild(wrapped_class, future.result()):
+                if related_name is not None:
+                    setattr(obj, related_name, instance)
+                items.append(obj)
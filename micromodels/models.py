@@ -1,9 +1,303 @@
+from itertools import islice
+import mmap
+import multiprocessing
+import os
+import weakref
+
+# JSON goes through micromodels.backends; json is still imported here for
+# code which uses micromodels.models.json.
 try:
     import json
 except ImportError:
     import simplejson as json
 
-from .fields import BaseField
+from .cache import LRUCache
+from .columns import ModelCollectionList
+from .fields import BaseField, _converter, _immutable_types, _ordered
+from .sequences import LazyList
+from . import stream as _stream
+from . import encoder as _encoder
+from . import instrument as _instrument
+from . import identity as _identity
+from . import backends as _backends
+
+
+_missing = object()
+
+try:
+    _memoryview = memoryview
+except NameError:
+    # Python 2.6 has no memoryview; an empty tuple matches no instance.
+    _memoryview = ()
+
+# Every model class, for the instrumentation to find.
+_model_classes = weakref.WeakKeyDictionary()
+
+# How many compiled projection decoders each class keeps. They are kept on
+# the class, so that they go away with it.
+_projection_cache_size = 32
+
+# The instance's own mappings which it changes in place, and which a copy of
+# the instance therefore needs copies of.
+_owned_state = ('_raw', '_skipped', '_serial', '_changed', '_extra',
+                '_fields')
+
+
+def _compile_plan(fields):
+    '''Flattens a field table into a decode plan of
+    ``(source key, field, attribute name)`` steps.
+
+    '''
+    return tuple((field.source or name, field, name)
+                 for name, field in _ordered(fields))
+
+
+def _compile_decoder(plan, wrap=None):
+    '''Builds the decode method for a :class:`Model` class from its plan.
+
+    Decoding a dictionary runs straight through the plan and stores each
+    converted value without going through :meth:`Model.__setattr__`. If
+    ``wrap`` is given, each converter is replaced by ``wrap(converter,
+    attribute name)``.
+
+    '''
+    steps = tuple((key, _converter(field), name) for key, field, name in plan)
+    if wrap is not None:
+        steps = tuple((key, wrap(convert, name), name)
+                      for key, convert, name in steps)
+    store = object.__setattr__
+
+    def decode(self, data):
+        for key, convert, name in steps:
+            if key in data:
+                store(self, name, convert(data[key], self))
+        raw = self._raw
+        if raw:
+            for key, convert, name in steps:
+                if key in data:
+                    raw.pop(name, None)
+
+    return decode
+
+
+def _compile_lazy_decoder(plan):
+    '''Builds the lazy decode method for a :class:`Model` class from its plan.
+
+    Rather than being converted, the source values are kept in the instance's
+    ``_raw`` mapping, and each is converted by a :class:`_LazyAttribute` the
+    first time it is read.
+
+    '''
+    store = object.__setattr__
+
+    def decode_lazy(self, data):
+        raw = self._raw
+        if raw is Model._raw:
+            raw = {}
+            store(self, '_raw', raw)
+        values = self.__dict__
+        for key, field, name in plan:
+            if key in data:
+                raw[name] = data[key]
+                values.pop(name, None)
+
+    return decode_lazy
+
+
+def _projection_tree(paths):
+    '''Turns dotted field paths into a tree mapping each field name to the
+    tree of its nested paths, or to ``None`` for the whole field.
+
+    '''
+    tree = {}
+    for path in paths:
+        name, _, rest = path.partition('.')
+        if not rest:
+            tree[name] = None
+        elif tree.get(name, {}) is not None:
+            tree.setdefault(name, {}).setdefault(rest, None)
+    return dict((name, subtree and _projection_tree(subtree))
+                for name, subtree in tree.iteritems())
+
+
+def _projected_decoder(cls, only, exclude):
+    '''Returns the decoder of ``cls`` for a projection, compiling it the
+    first time. ``only`` and ``exclude`` are projection trees or ``None``.
+
+    '''
+    key = (_freeze(only), _freeze(exclude))
+    projections = cls._projections
+    decode = projections.get(key)
+    if decode is None:
+        decode = _compile_projection(cls, only, exclude)
+        projections.set(key, decode)
+    return decode
+
+
+def _freeze(tree):
+    if tree is None:
+        return None
+    return frozenset((name, _freeze(subtree))
+                     for name, subtree in tree.iteritems())
+
+
+def _compile_projection(cls, only, exclude):
+    '''Builds the decode method of ``cls`` for a projection. The source
+    values of the fields it leaves out are kept in the instance's
+    ``_skipped`` mapping.
+
+    '''
+    for tree in (only, exclude):
+        for name in tree or ():
+            if name not in cls._clsfields:
+                raise ValueError('%s has no field %r' % (cls.__name__, name))
+    plan = []
+    skipped = []
+    nested = {}
+    for key, field, name in cls._plan:
+        nested_only = None if only is None else only.get(name, _missing)
+        nested_exclude = exclude and exclude.get(name, _missing)
+        if nested_only is _missing or (exclude and nested_exclude is None):
+            skipped.append((key, name))
+            continue
+        plan.append((key, field, name))
+        if nested_only or (exclude and nested_exclude is not _missing):
+            nested[name] = _nested_converter(
+                cls, name, field, nested_only or None,
+                None if nested_exclude is _missing else nested_exclude)
+    if _instrument.enabled:
+        wrap = lambda convert, name: _instrument._timed(
+            nested.get(name, convert), cls.__name__, name)
+    else:
+        wrap = lambda convert, name: nested.get(name, convert)
+    decode = _compile_decoder(tuple(plan), wrap)
+    if not skipped:
+        return decode
+    skipped = tuple(skipped)
+    store = object.__setattr__
+
+    def decode_projected(self, data):
+        decode(self, data)
+        values = dict((name, data[key]) for key, name in skipped
+                      if key in data)
+        if values:
+            store(self, '_skipped', values)
+
+    return decode_projected
+
+
+def _nested_converter(cls, name, field, only, exclude):
+    '''Returns a converter for the :class:`ModelField` or
+    :class:`ModelCollectionField` ``field`` which decodes the nested models
+    with a projection.
+
+    '''
+    from .fields import ModelField, ModelCollectionField, _behaves_like
+    field_class = type(field)
+    if _behaves_like(field_class, ModelField):
+        many = False
+    elif (_behaves_like(field_class, ModelCollectionField) and
+            not field.columnar and not field.lazy):
+        many = True
+    else:
+        raise ValueError('%s.%s cannot be projected into'
+                         % (cls.__name__, name))
+    wrapped_class = field._wrapped_class
+    decode = _projected_decoder(wrapped_class, only, exclude)
+    related_name = field._related_name
+
+    def convert_item(value, context):
+        if isinstance(value, wrapped_class):
+            obj = value
+        else:
+            obj = wrapped_class()
+            decode(obj, value or {})
+        if related_name is not None:
+            setattr(obj, related_name, context)
+        return obj
+
+    if not many:
+        return convert_item
+    return lambda value, context=None: [convert_item(item, context)
+                                        for item in value]
+
+
+class _LazyAttribute(object):
+    '''Non-data descriptor standing in for a field of a :class:`Model` class.
+
+    Converted values live in the instance dictionary, which takes precedence
+    over this descriptor, so it is only consulted for values that are still
+    raw (or missing altogether). It converts the raw value and caches the
+    result on the instance.
+
+    '''
+    def __init__(self, name, field):
+        self.name = name
+        self.convert = _converter(field)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        name = self.name
+        raw = instance._raw
+        if name not in raw:
+            raise AttributeError(name)
+        value = self.convert(raw[name], instance)
+        instance.__dict__[name] = value
+        raw.pop(name, None)
+        return value
+
+
+def _chunked(iterable, size):
+    '''Yields lists of at most ``size`` items from ``iterable``.'''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _decode_chunk(task):
+    '''Decodes a chunk of items in a worker process of
+    :meth:`Model.from_dicts`. Only the state of each instance is sent back,
+    since a list of plain dictionaries pickles a good deal faster than the
+    instances themselves, unless values nested in the instances refer back
+    to them: those references would be unpickled as separate copies.
+
+    '''
+    cls, items, is_json = task
+    if is_json:
+        items = map(_backends._for_model(cls).loads, items)
+    if cls._refers_back:
+        return list(cls._decode_all(items))
+    return [instance.__getstate__() for instance in cls._decode_all(items)]
+
+
+def _listed_models(value):
+    '''Returns the models in ``value`` if it is a list, or those which have
+    been converted if it is a lazy list.
+
+    '''
+    kind = type(value)
+    if kind is LazyList:
+        value = value._converted_values()
+    elif kind is not list:
+        return ()
+    return [item for item in value if isinstance(item, Model)]
+
+
+def _rebuild(cls, results):
+    '''Yields the instances of a chunk decoded by :func:`_decode_chunk`.'''
+    new = cls.__new__
+    for result in results:
+        if isinstance(result, cls):
+            yield result
+            continue
+        instance = new(cls)
+        instance.__setstate__(result)
+        yield instance
+
 
 class Model(object):
     """The Model is the main component of micromodels. Model makes it trivial
@@ -25,14 +319,14 @@ class Model(object):
 
     First, the model checks if it has a field with a name matching the key.
 
-    If there is a matching field, then :meth:`to_python` is called on the field
+    If there is a matching field, then :meth:`convert` is called on the field
     with the value.
-        If :meth:`to_python` does not raise an exception, then the result of
-        :meth:`to_python` is set on the instance, and the method is completed.
+        If :meth:`convert` does not raise an exception, then the result of
+        :meth:`convert` is set on the instance, and the method is completed.
         Essentially, this means that the first thing setting an attribute tries
         to do is process the data as if it was a "primitive" data type.
 
-        If :meth:`to_python` does raise an exception, this means that the data
+        If :meth:`convert` does raise an exception, this means that the data
         might already be an appropriate Python type. The :class:`Model` then
         attempts to *serialize* the data into a "primitive" type using the
         field's :meth:`to_serial` method.
@@ -45,34 +339,321 @@ class Model(object):
     If the instance doesn't have a field matching the key, then the key and
     value are just set on the instance like any other assignment in Python.
 
+    Setting ``__compact__ = True`` on a model class stores the values of its
+    fields in ``__slots__`` rather than in an instance dictionary, which
+    saves a good deal of memory when very many small instances are kept
+    around. The instance dictionary of a compact model is only allocated
+    if a field is added with :meth:`add_field` or some other attribute is
+    set on it.
+
+    ``__json__`` names the JSON library the model decodes and encodes JSON
+    with; see :mod:`micromodels.backends`. ``__cache__`` may be a
+    :class:`~micromodels.cache.DecodeCache` for :meth:`from_dict` to use.
+
     """
     class __metaclass__(type):
         '''Creates the metaclass for Model. The main function of this metaclass
         is to move all of fields into the _fields variable on the class.
 
+        The fields of every base class are merged in, in method resolution
+        order, so a subclass has the fields of its bases as well as its own.
+        Everything derived from the field table (the decode and encode
+        plans, the descriptors and the slots of compact models) is built
+        once, here.
+
         '''
-        def __init__(cls, name, bases, attrs):
-            cls._clsfields = {}
-            for key, value in attrs.iteritems():
+        def __new__(mcs, name, bases, attrs):
+            declared = {}
+            for key, value in attrs.items():
                 if isinstance(value, BaseField):
-                    cls._clsfields[key] = value
-                    delattr(cls, key)
+                    declared[key] = attrs.pop(key)
+            attrs['_declared_fields'] = declared
+            compact = attrs.get('__compact__',
+                                any(getattr(base, '__compact__', False)
+                                    for base in bases))
+            if compact:
+                if attrs.get('__lazy__'):
+                    raise TypeError('Compact models cannot be lazy')
+                if '__slots__' not in attrs:
+                    # Only fields which no base keeps in a slot get one.
+                    # The set of changed fields gets one too, so tracking
+                    # changes never allocates an instance dictionary.
+                    names = set(declared)
+                    names.add('_changed')
+                    slotted = set()
+                    for base in bases:
+                        names.update(getattr(base, '_clsfields', ()))
+                        for klass in base.__mro__:
+                            slotted.update(klass.__dict__.get('__slots__', ()))
+                    attrs['__slots__'] = tuple(sorted(names - slotted))
+            cls = type.__new__(mcs, name, bases, attrs)
+            fields = {}
+            for klass in reversed(cls.__mro__):
+                fields.update(klass.__dict__.get('_declared_fields', ()))
+            if not compact:
+                for key, field in fields.iteritems():
+                    setattr(cls, key, _LazyAttribute(key, field))
+            cls._clsfields = cls._fields = fields
+            cls._field_items = tuple(_ordered(fields))
+            cls._plan = _compile_plan(cls._clsfields)
+            cls._sources = dict((key, field) for key, field, name in cls._plan)
+            cls._decode = _compile_decoder(cls._plan)
+            cls._decode_lazy = _compile_lazy_decoder(cls._plan)
+            cls._projections = LRUCache(_projection_cache_size)
+            cls._json_plan = _encoder.compile_plan(cls._clsfields)
+            cls._serial_fields = frozenset(
+                name for name, field, key, kind in cls._json_plan
+                if kind is _encoder._SERIAL)
+            cls._shares_identity = any(
+                getattr(field, 'identity', None) is not None or
+                getattr(getattr(field, '_wrapped_class', None),
+                        '_shares_identity', False)
+                for field in fields.itervalues())
+            # Whether values nested in instances can refer back to them:
+            # related objects, and lazy and columnar collections which keep
+            # their instance as the context of later conversions.
+            cls._refers_back = any(
+                getattr(field, '_related_name', None) is not None or
+                getattr(field, 'lazy', False) or
+                getattr(field, 'columnar', False)
+                for field in fields.itervalues())
+            _model_classes[cls] = True
+            if _instrument.enabled:
+                _instrument._instrument_class(cls)
+            return cls
 
-    def __init__(self):
-        super(Model, self).__setattr__('_extra', {})
+    __compact__ = False
+    __lazy__ = False
+    __json__ = None
+    __cache__ = None
+
+    # Shared by every instance until add_field gives it its own mapping, so it
+    # must never be modified in place. Likewise _fields is the class's field
+    # table until add_field stores the merge of that table and _extra on the
+    # instance. _raw holds source values that a lazy decode has not converted
+    # yet, _skipped those that a projection left out and _serial the
+    # serialized forms of converted values; all three are shared in the same
+    # way. _changed holds the names of the fields set since decoding, and is
+    # replaced by a set of the instance's own on the first change; compact
+    # models keep it in a slot, which is unset until then.
+    _extra = {}
+    _raw = {}
+    _skipped = {}
+    _serial = {}
+    _changed = frozenset()
 
     @classmethod
-    def from_dict(cls, D, is_json=False):
+    def from_dict(cls, D, is_json=False, lazy=None, only=None, exclude=None,
+                  cache=None):
         '''This factory for :class:`Model`
         takes either a native Python dictionary or a JSON dictionary/object
         if ``is_json`` is ``True``. The dictionary passed does not need to
         contain all of the values that the Model declares.
 
+        If ``lazy`` is ``True``, values are only converted the first time
+        they are read, and values that are never read are serialized
+        without being converted at all. It defaults to the ``__lazy__``
+        attribute of the class. Compact models cannot be decoded lazily.
+
+        ``only`` and ``exclude`` are lists of field names to decode or to
+        leave out. Names may be dotted paths into :class:`ModelField` and
+        :class:`ModelCollectionField` fields, such as ``'user.name'``.
+        Fields which are left out are not set, and their source values are
+        available from :meth:`raw_value`. Projections are compiled once for
+        each class, and cannot be combined with lazy decoding.
+
+        ``cache`` may be a :class:`~micromodels.cache.DecodeCache` to look
+        JSON text up in before decoding it, and to keep the result in. It
+        defaults to the ``__cache__`` attribute of the class.
+
         '''
+        if lazy is None:
+            lazy = cls.__lazy__ and only is None and exclude is None
+        if cache is None:
+            cache = cls.__cache__
+        key = None
+        if cache is not None and is_json:
+            key = cache._key(cls, D, lazy,
+                             None if only is None else tuple(only),
+                             None if exclude is None else tuple(exclude))
+            if key is not None:
+                instance = cache._get(key)
+                if instance is not None:
+                    return instance
+        if is_json:
+            D = _backends._for_model(cls).loads(D)
         instance = cls()
-        instance.set_data(D, is_json=is_json)
+        if only is not None or exclude is not None:
+            if lazy:
+                raise TypeError('Projections cannot be decoded lazily')
+            decode = _projected_decoder(
+                cls, None if only is None else _projection_tree(only),
+                _projection_tree(exclude or ()) or None)
+        elif lazy:
+            if cls.__compact__:
+                raise TypeError('Compact models cannot be lazy')
+            decode = cls._decode_lazy
+        else:
+            decode = cls._decode
+        if cls._shares_identity and _identity.current() is None:
+            with _identity.IdentityMap():
+                decode(instance, D)
+        else:
+            decode(instance, D)
+        if key is not None:
+            return cache._set(key, instance)
         return instance
 
+    @classmethod
+    def from_dict_incremental(cls, D, is_json=False, slice_size=500,
+                              executor=None):
+        '''Returns a :class:`~micromodels.incremental.IncrementalDecode` of
+        ``D``, which builds the same instance as :meth:`from_dict` a slice
+        of work at a time as it is iterated over, for use from event loops.
+        The instance is in its ``result`` attribute once iteration is over.
+        Parsing JSON (if ``is_json`` is ``True``) is not split up.
+
+        ``executor`` may be a :mod:`concurrent.futures` executor to convert
+        the items of model collections in.
+
+        '''
+        from .incremental import IncrementalDecode
+        if is_json:
+            D = _backends._for_model(cls).loads(D)
+        return IncrementalDecode(cls, D, slice_size, executor)
+
+    @classmethod
+    def from_dicts(cls, items, is_json=False, chunk_size=None, workers=None):
+        '''This factory for :class:`Model` takes an iterable of dictionaries
+        (or of JSON strings if ``is_json`` is ``True``) and lazily yields an
+        instance for each of them, decoded lazily if the class sets
+        ``__lazy__``.
+
+        If ``chunk_size`` is given, lists of at most ``chunk_size`` instances
+        are yielded instead, so only one chunk is held in memory at a time.
+
+        If ``workers`` is given, the items are decoded in chunks by a pool of
+        that many processes, and the instances are yielded in their original
+        order. The class must be importable by the worker processes, and
+        this only pays off when there are many items or their conversions
+        are costly.
+
+        '''
+        if workers:
+            instances = cls._decode_parallel(items, is_json, workers,
+                                             chunk_size or 1000)
+        else:
+            if is_json:
+                loads = _backends._for_model(cls).loads
+                items = (loads(item) for item in items)
+            instances = cls._decode_all(items)
+        if chunk_size is None:
+            return instances
+        return _chunked(instances, chunk_size)
+
+    @classmethod
+    def from_json_lines(cls, stream, chunk_size=None):
+        '''This factory for :class:`Model` takes a file-like object (or any
+        iterable of lines) containing one JSON object per line and lazily
+        yields an instance for each of them. Blank lines are skipped.
+
+        ``chunk_size`` behaves as it does for :meth:`from_dicts`.
+
+        '''
+        return cls.from_dicts((line for line in stream if line.strip()),
+                              is_json=True, chunk_size=chunk_size)
+
+    @classmethod
+    def from_json_stream(cls, stream):
+        '''This factory for :class:`Model` incrementally decodes a JSON object
+        read from the file-like ``stream``. Keys the model does not declare
+        are skipped without being decoded, and the items of
+        :class:`~micromodels.ModelCollectionField` arrays are converted as
+        they are read, so the raw document is never held in memory.
+
+        '''
+        return _identity._scoped(cls, _stream.read_model,
+                                 _stream.JSONStreamReader(stream), cls)
+
+    @classmethod
+    def from_buffer(cls, data):
+        '''This factory for :class:`Model` decodes the JSON object in ``data``
+        as :meth:`from_json_stream` does, but from a string, ``bytearray``,
+        ``mmap`` or other buffer which is scanned in place. Only the values
+        of the keys the model declares are copied out of it and decoded.
+
+        ``memoryview`` objects are copied once first, as Python 2's regular
+        expressions cannot scan them.
+
+        '''
+        if isinstance(data, _memoryview):
+            data = data.tobytes()
+        elif not isinstance(data, (basestring, mmap.mmap)):
+            data = buffer(data)
+        return _identity._scoped(cls, _stream.read_document,
+                                 _stream.JSONBufferReader(data), cls)
+
+    @classmethod
+    def from_file(cls, path):
+        '''This factory for :class:`Model` memory-maps the file at ``path``
+        and decodes the JSON object in it with :meth:`from_buffer`, so the
+        file is never read into memory as a whole.
+
+        '''
+        with open(path, 'rb') as input:
+            if not os.fstat(input.fileno()).st_size:
+                # Empty files cannot be mapped, and hold no document.
+                return cls.from_buffer('')
+            data = mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls.from_buffer(data)
+        finally:
+            data.close()
+
+    @classmethod
+    def iter_json(cls, stream, name=None):
+        '''Lazily yields instances decoded from the file-like ``stream``.
+
+        If ``name`` is ``None``, the stream must contain a JSON array of
+        objects, and an instance of this class is yielded for each of them.
+        Otherwise the stream must contain a JSON object for this class, and
+        the items of its :class:`~micromodels.ModelCollectionField` ``name``
+        are yielded as they are read; the rest of the object is skipped.
+        Either way only one item is held in memory at a time.
+
+        '''
+        reader = _stream.JSONStreamReader(stream)
+        if name is None:
+            instances = _stream.iter_models(reader, cls)
+        else:
+            instances = _stream.iter_collection(reader, cls, name)
+        return _identity._iter_scoped(cls, instances)
+
+    @classmethod
+    def _decode_all(cls, items):
+        return _identity._iter_scoped(cls, cls._decode_each(items))
+
+    @classmethod
+    def _decode_each(cls, items):
+        decode = cls._decode_lazy if cls.__lazy__ else cls._decode
+        for data in items:
+            instance = cls()
+            decode(instance, data)
+            yield instance
+
+    @classmethod
+    def _decode_parallel(cls, items, is_json, workers, chunk_size):
+        pool = multiprocessing.Pool(workers)
+        try:
+            tasks = ((cls, chunk, is_json)
+                     for chunk in _chunked(items, chunk_size))
+            for results in pool.imap(_decode_chunk, tasks):
+                for instance in _rebuild(cls, results):
+                    yield instance
+        finally:
+            pool.terminate()
+            pool.join()
+
     @classmethod
     def from_kwargs(cls, **kwargs):
         '''This factory for :class:`Model` only takes keywork arguments.
@@ -86,24 +667,126 @@ class Model(object):
 
     def set_data(self, data, is_json=False):
         if is_json:
-            data = json.loads(data)
-        for name, field in self._clsfields.iteritems():
-            key = field.source or name
+            data = _backends._for_model(type(self)).loads(data)
+        self._decode(data)
+        for key, field, name in self._plan:
             if key in data:
-                setattr(self, name, data.get(key))
+                self._touch(name)
 
     def __setattr__(self, key, value):
         if key in self._fields:
-            field = self._fields[key]
-            field.populate(value)
-            field._related_obj = self
-            super(Model, self).__setattr__(key, field.to_python())
+            convert = _converter(self._fields[key])
+            super(Model, self).__setattr__(key, convert(value, self))
+            if key in self._raw:
+                del self._raw[key]
+            if key in self._skipped:
+                del self._skipped[key]
+            self._touch(key)
         else:
             super(Model, self).__setattr__(key, value)
 
-    @property
-    def _fields(self):
-        return dict(self._clsfields, **self._extra)
+    def _touch(self, key):
+        '''Records that the value of the field ``key`` has changed.'''
+        if key in self._serial:
+            del self._serial[key]
+        changed = getattr(self, '_changed', Model._changed)
+        if changed is Model._changed:
+            changed = set()
+            super(Model, self).__setattr__('_changed', changed)
+        changed.add(key)
+
+    def _serial_value(self, key, field, value):
+        '''Returns ``field.to_serial(value)`` for the converted value of the
+        field ``key``, remembering it until the field is set again if the
+        value is immutable. Compact models do not remember them, as that
+        would allocate their instance dictionary.
+
+        '''
+        cache = self._serial
+        if key in cache:
+            return cache[key]
+        serial = field.to_serial(value)
+        if type(value) in _immutable_types and not self.__compact__:
+            if cache is Model._serial:
+                cache = {}
+                super(Model, self).__setattr__('_serial', cache)
+            cache[key] = serial
+        return serial
+
+    def raw_value(self, key):
+        '''Returns the source value of the field ``key`` if it has not been
+        converted, because a projection left it out or a lazy decode has
+        not converted it yet. Raises ``KeyError`` otherwise.
+
+        '''
+        if key in self._raw:
+            return self._raw[key]
+        return self._skipped[key]
+
+    def __getstate__(self):
+        '''Returns the converted values, raw values and added fields of the
+        instance, so that unpickling never converts anything again.
+
+        '''
+        if not self.__compact__:
+            return self.__dict__
+        state = dict(self.__dict__)
+        for klass in type(self).__mro__:
+            for name in klass.__dict__.get('__slots__', ()):
+                value = getattr(self, name, _missing)
+                if value is not _missing:
+                    state[name] = value
+        return state
+
+    def __setstate__(self, state):
+        if not self.__compact__:
+            self.__dict__.update(state)
+            return
+        store = object.__setattr__
+        for name, value in state.iteritems():
+            store(self, name, value)
+
+    def __copy__(self):
+        '''Returns a shallow copy of the instance, which shares its values
+        but not the mappings that changing or reading it updates.
+
+        '''
+        cls = type(self)
+        copy = cls.__new__(cls)
+        state = dict(self.__getstate__())
+        for name in _owned_state:
+            if name in state:
+                state[name] = state[name].copy()
+        copy.__setstate__(state)
+        return copy
+
+    def _clone(self, memo=None):
+        '''Returns a copy of the instance which shares nothing that can be
+        changed in place with it: nested models, lists, lazy and columnar
+        lists, mappings and sets are copied, other values are shared. Models which occur
+        several times in the tree are copied once.
+
+        '''
+        if memo is None:
+            memo = {}
+        copy = memo.get(id(self))
+        if copy is not None:
+            return copy
+        cls = type(self)
+        copy = memo[id(self)] = cls.__new__(cls)
+        state = dict(self.__getstate__())
+        for key, value in state.iteritems():
+            kind = type(value)
+            if (isinstance(value, Model) or kind is LazyList or
+                    kind is ModelCollectionList):
+                state[key] = value._clone(memo)
+            elif kind is list:
+                state[key] = [item._clone(memo) if isinstance(item, Model)
+                              else item for item in value]
+            elif kind is dict or kind is set:
+                state[key] = kind(value)
+        copy.__setstate__(state)
+        return copy
 
     def add_field(self, key, value, field):
         ''':meth:`add_field` must be used to add a field to an existing
@@ -112,7 +795,12 @@ class Model(object):
         reassigned without using this method.
 
         '''
+        if self._extra is Model._extra:
+            super(Model, self).__setattr__('_extra', {})
         self._extra[key] = field
+        fields = dict(self._clsfields)
+        fields.update(self._extra)
+        super(Model, self).__setattr__('_fields', fields)
         setattr(self, key, value)
 
 
@@ -123,16 +811,150 @@ class Model(object):
         unless ``serial`` is set to True.
 
         '''
-        if serial:
-            return dict((key, self._fields[key].to_serial(getattr(self, key)))
-                        for key in self._fields.keys() if hasattr(self, key))
-        else:
-            return dict((key, getattr(self, key)) for key in self._fields.keys()
-                       if hasattr(self, key))
+        data = {}
+        raw = self._raw
+        cached = self._serial_fields
+        for key, field in self._items():
+            if serial and key in raw:
+                data[key] = field.raw_to_serial(raw[key])
+                continue
+            value = getattr(self, key, _missing)
+            if value is _missing:
+                continue
+            if not serial:
+                data[key] = value
+            elif key in cached:
+                data[key] = self._serial_value(key, field, value)
+            else:
+                data[key] = field.to_serial(value)
+        return data
+
+    def _items(self):
+        '''Returns the ``(name, field)`` pairs of the instance's fields in
+        the order in which they were declared.
+
+        '''
+        if self._fields is self._clsfields:
+            return self._field_items
+        return _ordered(self._fields)
 
-    def to_json(self):
+    def to_patch(self):
+        '''Returns a dictionary of the serialized values of the fields which
+        have been set since the instance was decoded, or since
+        :meth:`mark_clean` was last called, in the form of a JSON Merge
+        Patch (RFC 7386). Nested models which were changed in place appear
+        as patches of their own, and lists of models in which any model was
+        changed appear whole.
+
+        '''
+        patch = {}
+        changed = getattr(self, '_changed', ())
+        raw = self._raw
+        for key, field in self._items():
+            if key in raw:
+                continue
+            value = getattr(self, key, _missing)
+            if value is _missing:
+                continue
+            if key in changed:
+                if key in self._serial_fields:
+                    patch[key] = self._serial_value(key, field, value)
+                else:
+                    patch[key] = field.to_serial(value)
+            elif isinstance(value, Model):
+                nested = value.to_patch()
+                if nested:
+                    patch[key] = nested
+            elif any(item.is_dirty() for item in _listed_models(value)):
+                patch[key] = field.to_serial(value)
+        return patch
+
+    def is_dirty(self):
+        '''Returns ``True`` if any field of the instance, or of the models
+        nested in it, has been set since decoding or :meth:`mark_clean`.
+
+        '''
+        if getattr(self, '_changed', None):
+            return True
+        for value in self._converted_models():
+            if value.is_dirty():
+                return True
+        return False
+
+    def mark_clean(self):
+        '''Forgets the changes made to the instance and to the models
+        nested in it, for example once they have been saved.'''
+        if getattr(self, '_changed', None):
+            super(Model, self).__setattr__('_changed', Model._changed)
+        for value in self._converted_models():
+            value.mark_clean()
+
+    def _converted_models(self):
+        '''Yields the nested models which have been converted.'''
+        raw = self._raw
+        for key, field in self._items():
+            if key in raw:
+                continue
+            value = getattr(self, key, None)
+            if isinstance(value, Model):
+                yield value
+            else:
+                for item in _listed_models(value):
+                    yield item
+
+    @classmethod
+    def _raw_to_serial(cls, data):
+        '''Serializes a source dictionary for this class without building an
+        instance, as :meth:`to_dict` would for a lazily decoded instance
+        that was never read.
+
+        '''
+        serial = {}
+        for key, field, name in cls._plan:
+            if key in data:
+                serial[name] = field.raw_to_serial(data[key])
+        return serial
+
+    def to_json(self, stream=None):
         '''Returns a representation of the model as a JSON string. This method
         relies on the :meth:`~micromodels.Model.to_dict` method.
 
+        If a file-like ``stream`` is given, the JSON is written to it as it is
+        produced instead. The model tree is then walked once, without
+        building the intermediate dictionaries or the whole string, so large
+        collections can be written out incrementally.
+
+        '''
+        if stream is None:
+            return _backends._for_model(type(self)).dumps(
+                self.to_dict(serial=True))
+        _encoder.write_model(self, stream.write)
+
+    def to_msgpack(self):
+        '''Returns the instance and the models nested in it as MessagePack
+        bytes, keeping their converted values so that :meth:`from_msgpack`
+        does not convert anything again. See :mod:`micromodels.binary`.
+
+        '''
+        from .binary import pack
+        return pack(self)
+
+    @classmethod
+    def from_msgpack(cls, data):
+        '''This factory for :class:`Model` rebuilds an instance from bytes
+        produced by :meth:`to_msgpack`. Only data from a trusted source
+        should be given to it, as it is not converted or checked.
+
+        '''
+        from .binary import unpack
+        return unpack(cls, data)
+
+    def to_json_pieces(self, slice_size=500):
+        '''Lazily yields the JSON representation of the model in pieces which
+        each take a bounded amount of work to produce, for writing to a
+        socket from an event loop between other work. Lists of models are
+        written ``slice_size`` items per piece. The pieces join up to the
+        same JSON as :meth:`to_json` writes to a stream.
+
         '''
-        return json.dumps(self.to_dict(serial=True))
+        return _encoder.iter_model(self, slice_size)
@@ -0,0 +1,108 @@
+'''Sequences returned by the collection fields.'''
+
+_missing = object()
+
+
+class LazyList(object):
+    """A read-only sequence which converts the source items of a collection
+    field only when they are indexed or iterated over, remembering each
+    converted item.
+
+    ``len()`` and slicing never convert more items than they return, and
+    :meth:`to_serial` passes items which were never converted straight
+    through, so a large collection of which only the first few items are
+    read costs little more than the source list itself.
+
+    """
+    def __init__(self, field, items, context=None):
+        self.field = field
+        self._items = items if type(items) is list else list(items or ())
+        self._values = [_missing] * len(self._items)
+        self._context = context
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(i)
+                    for i in xrange(*index.indices(len(self._items)))]
+        if index < 0:
+            index += len(self._items)
+        if not 0 <= index < len(self._items):
+            raise IndexError('LazyList index out of range')
+        return self._get(index)
+
+    def __iter__(self):
+        for index in xrange(len(self._items)):
+            yield self._get(index)
+
+    def __eq__(self, other):
+        if isinstance(other, (LazyList, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return '<LazyList of %d items, %d converted>' % (
+            len(self._items), self.converted())
+
+    def _get(self, index):
+        value = self._values[index]
+        if value is _missing:
+            value = self.field._convert_item(self._items[index],
+                                             self._context)
+            self._values[index] = value
+        return value
+
+    def __getstate__(self):
+        # The marker of unconverted items would not be itself once unpickled
+        # or deep-copied, so only the converted items are kept, by index.
+        state = dict(self.__dict__)
+        state['_values'] = [(index, value)
+                            for index, value in enumerate(self._values)
+                            if value is not _missing]
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        converted = state.pop('_values')
+        self.__dict__.update(state)
+        self._values = [_missing] * len(self._items)
+        for index, value in converted:
+            self._values[index] = value
+
+    def _clone(self, memo):
+        '''Returns a copy for :meth:`~micromodels.Model._clone`, which
+        shares no state with this list: converted items are cloned, and the
+        context becomes its clone if it has one in ``memo``.
+
+        '''
+        copy = LazyList.__new__(LazyList)
+        copy.field = self.field
+        copy._items = list(self._items)
+        copy._values = [value._clone(memo) if hasattr(value, '_clone')
+                        else value for value in self._values]
+        copy._context = memo.get(id(self._context), self._context)
+        return copy
+
+    def _converted_values(self):
+        '''Returns the items which have been converted.'''
+        return [value for value in self._values if value is not _missing]
+
+    def converted(self):
+        '''Returns the number of items which have been converted.'''
+        return len(self._values) - self._values.count(_missing)
+
+    def to_serial(self):
+        '''Serializes every item, without converting those which have not
+        been converted yet.
+
+        '''
+        field = self.field
+        return [field._raw_item_to_serial(item) if value is _missing
+                else field._item_to_serial(value)
+                for item, value in zip(self._items, self._values)]
@@ -0,0 +1,291 @@
+'''Incremental decoding of JSON documents read from file-like objects.
+
+The reader only ever builds Python objects for the keys a model declares.
+Undeclared values are scanned past and thrown away, and the items of a
+:class:`~micromodels.ModelCollectionField` are decoded one at a time, so
+memory use is bounded by the models being built rather than by the size of
+the document.
+
+'''
+import re
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from .fields import ModelField, ModelCollectionField
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRUCTURE = re.compile(r'["\[\]{}]')
+_SIMPLE_STRING = re.compile(r'"[^"\\]*"')
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+_SCALAR = re.compile(r'[^,:\[\]{}" \t\n\r]*')
+
+
+class JSONStreamReader(object):
+    """Reads JSON values one at a time from a file-like object.
+
+    ``stream`` only needs a ``read(size)`` method. ``chunk_size`` sets how
+    much is read from it at once.
+
+    """
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self._read = stream.read
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+
+    def _fill(self, keep_from=None):
+        '''Reads another chunk into the buffer, discarding everything before
+        ``keep_from`` (or before the current position). Returns the number of
+        characters discarded.
+
+        '''
+        chunk = self._read(self.chunk_size)
+        if not chunk:
+            raise ValueError('Unexpected end of JSON stream')
+        start = self.pos if keep_from is None else keep_from
+        self.buf = self.buf[start:] + chunk
+        self.pos -= start
+        return start
+
+    def peek(self):
+        '''Skips whitespace and returns the next character.'''
+        try:
+            char = self.buf[self.pos]
+        except IndexError:
+            pass
+        else:
+            if char not in ' \t\n\r':
+                return char
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self._fill()
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError('Expected %r at stream offset %d, found %r'
+                             % (char, self.pos, found))
+        self.pos += 1
+
+    def next_separator(self, closing):
+        '''Consumes a ``,`` or the ``closing`` character and returns ``True``
+        if more items follow.
+
+        '''
+        char = self.peek()
+        self.pos += 1
+        if char == ',':
+            return True
+        if char != closing:
+            raise ValueError('Expected %r or %r at stream offset %d, found %r'
+                             % (',', closing, self.pos - 1, char))
+        return False
+
+    def _scan(self, keep):
+        '''Moves past the value at the current position, returning its text if
+        ``keep`` is true. When ``keep`` is false, the buffer is discarded as
+        it is scanned, so skipping a value never holds more than a chunk.
+
+        '''
+        first = self.peek()
+        start = i = self.pos
+        if first == '"':
+            # Most strings have no escapes and are matched in one go.
+            match = _SIMPLE_STRING.match(self.buf, i)
+            if match is not None:
+                self.pos = match.end()
+                if keep:
+                    return self.buf[start:self.pos]
+                return
+        elif first not in '[{':
+            while True:
+                i = _SCALAR.match(self.buf, i).end()
+                if i < len(self.buf):
+                    break
+                try:
+                    shift = self._fill(start)
+                except ValueError:
+                    break
+                start -= shift
+                i -= shift
+            text = self.buf[start:i]
+            self.pos = i
+            return text
+
+        depth = 0
+        in_string = False
+        while True:
+            buf = self.buf
+            if in_string:
+                i = _STRING_BODY.match(buf, i).end()
+                if i < len(buf) and buf[i] == '"':
+                    i += 1
+                    in_string = False
+                    if depth == 0:
+                        break
+                    continue
+            else:
+                match = _STRUCTURE.search(buf, i)
+                if match is not None:
+                    i = match.end()
+                    char = match.group()
+                    if char == '"':
+                        in_string = True
+                    elif char in '[{':
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    continue
+                i = len(buf)
+            # The value continues past the end of the buffer.
+            self.pos = i
+            shift = self._fill(start if keep else i)
+            start -= shift
+            i -= shift
+        self.pos = i
+        if keep:
+            return self.buf[start:i]
+
+    def read_value(self):
+        '''Decodes and returns the value at the current position.'''
+        text = self._scan(True)
+        # Plain strings and integers are common enough to decode directly.
+        if text[:1] == '"' and '\\' not in text:
+            text = text[1:-1]
+            return text if type(text) is unicode else text.decode('utf-8')
+        if text.isdigit() and (text[0] != '0' or len(text) == 1):
+            return int(text)
+        return json.loads(text)
+
+    def skip_value(self):
+        '''Moves past the value at the current position without decoding it.'''
+        self._scan(False)
+
+    def iter_object(self):
+        '''Yields the keys of the object at the current position. Before the
+        next key is requested, the caller must consume the value with
+        :meth:`read_value`, :meth:`skip_value` or another nested read.
+
+        '''
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise ValueError('Expected an object key at stream offset %d'
+                                 % self.pos)
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            if not self.next_separator('}'):
+                return
+
+    def iter_array(self):
+        '''Yields once for each item of the array at the current position.
+        The caller must consume each item before asking for the next one.
+
+        '''
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if not self.next_separator(']'):
+                return
+
+
+class JSONBufferReader(JSONStreamReader):
+    """Reads JSON values one at a time from a document held in a string or
+    buffer, such as a memory-mapped file. The document is scanned in place,
+    and only the values which are decoded are copied out of it.
+
+    """
+    def __init__(self, data):
+        self.buf = data
+        self.pos = 0
+
+    def _fill(self, keep_from=None):
+        raise ValueError('Unexpected end of JSON document')
+
+    def expect_end(self):
+        '''Raises ``ValueError`` unless only whitespace is left.'''
+        self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+        if self.pos < len(self.buf):
+            raise ValueError('Extra data at document offset %d' % self.pos)
+
+
+def read_field(reader, field):
+    '''Reads the value for ``field`` from ``reader``. Nested models are
+    decoded incrementally, everything else is decoded as a whole. The items
+    of lazy collections are left as they are, to be converted on access.
+
+    '''
+    if isinstance(field, ModelField) and reader.peek() == '{':
+        return read_model(reader, field._wrapped_class)
+    if (isinstance(field, ModelCollectionField) and
+            not getattr(field, 'lazy', False) and reader.peek() == '['):
+        return list(iter_models(reader, field._wrapped_class))
+    return reader.read_value()
+
+
+def read_model(reader, cls):
+    '''Decodes the JSON object at the reader's position into an instance of
+    ``cls``, skipping every key that ``cls`` does not declare.
+
+    '''
+    sources = cls._sources
+    data = {}
+    for key in reader.iter_object():
+        field = sources.get(key)
+        if field is None:
+            reader.skip_value()
+        else:
+            data[key] = read_field(reader, field)
+    return cls.from_dict(data)
+
+
+def read_document(reader, cls):
+    '''Decodes the JSON object which is the whole document held by the
+    :class:`JSONBufferReader` ``reader`` into an instance of ``cls``.
+
+    '''
+    instance = read_model(reader, cls)
+    reader.expect_end()
+    return instance
+
+
+def iter_models(reader, cls):
+    '''Lazily decodes each object of the JSON array at the reader's position
+    into an instance of ``cls``.
+
+    '''
+    for _ in reader.iter_array():
+        yield read_model(reader, cls)
+
+
+def iter_collection(reader, cls, name):
+    '''Lazily decodes the items of the :class:`ModelCollectionField` ``name``
+    of the ``cls`` object at the reader's position. The rest of the object is
+    skipped, and reading stops once the collection has been consumed.
+
+    '''
+    field = cls._clsfields[name]
+    if not isinstance(field, ModelCollectionField):
+        raise TypeError('%s.%s is not a ModelCollectionField'
+                        % (cls.__name__, name))
+    source = field.source or name
+    for key in reader.iter_object():
+        if key == source and reader.peek() == '[':
+            for obj in iter_models(reader, field._wrapped_class):
+                yield obj
+            return
+        reader.skip_value()
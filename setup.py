@@ -29,6 +29,7 @@ setup(
     author_email='jamie.matthews@gmail.com',
     license='Public Domain',
     install_requires=["PySO8601"],
+    extras_require={"msgpack": ["msgpack>=0.6.1"]},
     classifiers = [
         'Programming Language :: Python',
         'Development Status :: 3 - Alpha',
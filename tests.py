@@ -4,6 +4,32 @@ import unittest
 import micromodels
 from micromodels.models import json
 
+
+# Models which pickling has to find by name.
+class PickledPerson(micromodels.Model):
+    name = micromodels.CharField()
+    born = micromodels.DateField('%Y-%m-%d')
+
+
+class CompactPickledPerson(micromodels.Model):
+    __compact__ = True
+    name = micromodels.CharField()
+    born = micromodels.DateField('%Y-%m-%d')
+
+
+class PickledFamily(micromodels.Model):
+    name = micromodels.CharField()
+    kids = micromodels.ModelCollectionField(PickledPerson,
+                                            related_name='parent')
+
+
+class PickledDiary(micromodels.Model):
+    name = micromodels.CharField()
+    people = micromodels.ModelCollectionField(PickledPerson, lazy=True,
+                                              related_name='diary')
+    rows = micromodels.ModelCollectionField(PickledPerson, columnar=True,
+                                            related_name='diary')
+
 class ClassCreationTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -34,6 +60,55 @@ class ClassCreationTestCase(unittest.TestCase):
         self.assertEqual(self.instance._fields['field_with_source'].source, 'foo')
 
 
+class InheritanceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class Base(micromodels.Model):
+            id = micromodels.IntegerField()
+            name = micromodels.CharField()
+
+        class Left(Base):
+            name = micromodels.CharField(source='title')
+            left = micromodels.BooleanField()
+
+        class Right(Base):
+            right = micromodels.FloatField()
+
+        class Both(Left, Right):
+            both = micromodels.CharField()
+
+        self.Base = Base
+        self.Both = Both
+
+    def test_fields_merged(self):
+        both = self.Both.from_dict({'id': '1', 'name': 'no', 'title': 'yes',
+                                    'left': 1, 'right': '2.5', 'both': 3})
+        self.assertEqual(both.to_dict(), {'id': 1, 'name': u'yes',
+                                          'left': True, 'right': 2.5,
+                                          'both': u'3'})
+        self.assertEqual(sorted(self.Base._clsfields), ['id', 'name'])
+
+    def test_declaration_order(self):
+        self.assertEqual([name for name, field in self.Both._field_items],
+                         ['id', 'name', 'left', 'right', 'both'])
+        both = self.Both.from_dict({'both': 'b', 'id': 1, 'left': 0})
+        self.assertEqual(next(both.to_json_pieces()),
+                         '{"id": 1, "left": false, "both": "b"}')
+
+    def test_compact_subclass(self):
+        class CompactBase(self.Base):
+            __compact__ = True
+
+        class CompactChild(CompactBase):
+            extra = micromodels.CharField()
+
+        self.assertEqual(CompactBase.__slots__, ('_changed', 'id', 'name'))
+        self.assertEqual(CompactChild.__slots__, ('extra',))
+        child = CompactChild.from_dict({'id': 1, 'extra': 'x'})
+        self.assertEqual(child.to_dict(), {'id': 1, 'extra': u'x'})
+        self.assertEqual(vars(child), {})
+
+
 class BaseFieldTestCase(unittest.TestCase):
 
     def test_field_without_provided_source(self):
@@ -47,6 +122,56 @@ class BaseFieldTestCase(unittest.TestCase):
         field = micromodels.fields.BaseField(source='customsource')
         self.assertEqual(field.source, 'customsource')
 
+    def test_convert_is_stateless(self):
+        """convert should not store the value on the field"""
+        field = micromodels.IntegerField()
+        self.assertEqual(field.convert('12'), 12)
+        self.assertFalse(hasattr(field, 'data'))
+
+    def test_legacy_to_python_override(self):
+        """Fields which only override to_python should still be used by models"""
+        class ShoutingField(micromodels.CharField):
+            def to_python(self):
+                return super(ShoutingField, self).to_python().upper()
+
+        class Greeting(micromodels.Model):
+            text = ShoutingField()
+
+        instance = Greeting.from_dict({'text': 'hello'})
+        self.assertEqual(instance.text, 'HELLO')
+        instance.text = 'bye'
+        self.assertEqual(instance.text, 'BYE')
+
+    def test_legacy_model_field_override(self):
+        """Legacy ModelField subclasses should still set related names"""
+        class Author(micromodels.Model):
+            name = micromodels.CharField()
+
+        class NamedField(micromodels.ModelField):
+            def to_python(self):
+                author = super(NamedField, self).to_python()
+                author.name = author.name.title()
+                return author
+
+        class Post(micromodels.Model):
+            author = NamedField(Author, related_name='post')
+
+        post = Post.from_dict({'author': {'name': 'eric'}})
+        self.assertEqual(post.author.name, 'Eric')
+        self.assertTrue(post.author.post is post)
+
+    def test_legacy_populate_override(self):
+        """Fields which only override populate should still be used by models"""
+        class DoublingField(micromodels.BaseField):
+            def populate(self, data):
+                self.data = data * 2
+
+        class Score(micromodels.Model):
+            points = DoublingField()
+
+        self.assertEqual(Score.from_dict({'points': 2}).points, 4)
+        self.assertEqual(Score.from_dict({'points': 2}, lazy=True).points, 4)
+
 
 class CharFieldTestCase(unittest.TestCase):
 
@@ -207,6 +332,117 @@ class DateTimeFieldTestCase(unittest.TestCase):
         self.assertEqual(expected, result)
 
 
+class DateParsingTestCase(unittest.TestCase):
+
+    def test_iso8601_matches_pyso8601(self):
+        import PySO8601
+        from micromodels import dates
+        for value in ["2010-07-13T14:01:00Z", "2010-07-13t14:01:00z",
+                      "2010-07-13T14:02:00-05:00", "2010-07-13 14:02:00",
+                      "2010-07-13T14:02:00.123456+01:30", "2010-12-28",
+                      " 2010-07-13T14:01:00 ", "20100713T140200-05:00",
+                      "2010-07-13T14:02:00.5Z", "2010-07-13T14:02+01"]:
+            expected = PySO8601.parse(value)
+            result = dates.parse_datetime(value)
+            self.assertEqual(result, expected)
+            self.assertEqual(result.isoformat(), expected.isoformat())
+
+    def test_iso8601_time_matches_pyso8601(self):
+        import PySO8601
+        from micromodels import dates
+        for value in ["09:33:30", "09:33:30.000120", "09:33:30Z", "093331"]:
+            self.assertEqual(dates.parse_time(value),
+                             PySO8601.parse_time(value).time())
+
+    def test_invalid_iso8601(self):
+        from micromodels import dates
+        self.assertRaises(ValueError, dates.parse_datetime, "2010-13-01")
+
+    def test_format_parser_matches_strptime(self):
+        import datetime
+        from micromodels import dates
+        for format, value in [("%Y-%m-%d", "2010-12-28"),
+                              ("%Y-%m-%d", "2010-1-2"),
+                              ("%d/%m/%y %H:%M", "28/12/68  09:05"),
+                              ("%d/%m/%y", "28/12/69"),
+                              ("%Y%m%dT%H%M%S.%f", "20101228t093330.25"),
+                              ("%H:%M:%S %%", "09:33:30 %"),
+                              ("%a %b %d %H:%M:%S +0000 %Y",
+                               "Tue Mar 21 20:50:14 +0000 2006")]:
+            self.assertEqual(dates.FormatParser(format)(value),
+                             datetime.datetime.strptime(value, format))
+
+    def test_format_parser_errors(self):
+        from micromodels import dates
+        parser = dates.FormatParser("%Y-%m-%d")
+        self.assertTrue(parser.regex is not None)
+        self.assertRaises(ValueError, parser, "2010-12-28 ")
+        self.assertRaises(ValueError, parser, "2010-02-30")
+        self.assertTrue(dates.FormatParser("%Y %b").regex is None)
+        self.assertTrue(dates.FormatParser("%Y %").regex is None)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_eviction(self):
+        from micromodels.cache import LRUCache
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(),
+                         {'hits': 3, 'misses': 1, 'size': 2, 'maxsize': 2})
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hits, 0)
+
+    def test_expiry(self):
+        from micromodels.cache import LRUCache
+        now = [0]
+        cache = LRUCache(2, ttl=10, timer=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 5
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 12
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual((cache.expired, len(cache)), (1, 1))
+        cache.delete('b')
+        self.assertEqual(cache.keys(), [])
+
+    def test_field_cache(self):
+        class Event(micromodels.Model):
+            at = micromodels.DateTimeField(cache_size=10)
+            kind = micromodels.CharField(cache_size=10)
+            tags = micromodels.FieldCollectionField(micromodels.CharField(),
+                                                    cache_size=10)
+
+        data = {'at': '2010-07-13T14:01:00Z', 'kind': 'click', 'tags': ['a']}
+        first = Event.from_dict(data)
+        second = Event.from_dict(data)
+        field = Event._clsfields['at']
+        self.assertEqual((field.cache.hits, field.cache.misses), (1, 1))
+        self.assertTrue(first.at is second.at)
+        self.assertEqual(second.to_dict(), first.to_dict())
+
+        tags = Event._clsfields['tags'].cache
+        self.assertEqual((tags.hits, len(tags)), (0, 0))
+        self.assertFalse(first.tags is second.tags)
+
+    def test_values_are_keyed_by_type(self):
+        class Thing(micromodels.Model):
+            name = micromodels.CharField(cache_size=10)
+
+        self.assertEqual(Thing.from_dict({'name': 1}).name, u'1')
+        self.assertEqual(Thing.from_dict({'name': 1.0}).name, u'1.0')
+        self.assertEqual(Thing.from_dict({'name': True}).name, u'True')
+
+
 class DateFieldTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -288,6 +524,26 @@ class InstanceTestCase(unittest.TestCase):
 
         self.assertEqual(instance.first, data['custom_source'])
 
+    def test_decode_bypasses_setattr(self):
+        assigned = []
+
+        class TrackedModel(micromodels.Model):
+            first = micromodels.CharField()
+            second = micromodels.IntegerField(source='other')
+
+            def __setattr__(self, key, value):
+                assigned.append(key)
+                super(TrackedModel, self).__setattr__(key, value)
+
+        instance = TrackedModel.from_dict({'first': 'a', 'other': '2'})
+        self.assertEqual(assigned, [])
+        self.assertEqual(instance.first, 'a')
+        self.assertEqual(instance.second, 2)
+
+        instance.set_data({'first': 'b'})
+        self.assertEqual(assigned, [])
+        self.assertEqual(instance.first, 'b')
+
 
 class ModelFieldTestCase(unittest.TestCase):
 
@@ -348,6 +604,39 @@ class ModelFieldTestCase(unittest.TestCase):
                           data)
                            
 
+    def test_concurrent_decoding(self):
+        import threading
+
+        class User(micromodels.Model):
+            name = micromodels.CharField()
+            aliases = micromodels.FieldCollectionField(micromodels.CharField())
+
+        class Post(micromodels.Model):
+            title = micromodels.CharField()
+            author = micromodels.ModelField(User, related_name='post')
+
+        errors = []
+
+        def decode(n):
+            for i in range(200):
+                title = 'post %d-%d' % (n, i)
+                post = Post.from_dict({'title': title,
+                                       'author': {'name': title,
+                                                  'aliases': [title]}})
+                if (post.author.post is not post or
+                        post.author.name != title or
+                        post.author.aliases != [title]):
+                    errors.append(title)
+
+        threads = [threading.Thread(target=decode, args=(n,))
+                   for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
 class ModelCollectionFieldTestCase(unittest.TestCase):
 
     def test_model_collection_field_creation(self):
@@ -420,6 +709,242 @@ class ModelCollectionFieldTestCase(unittest.TestCase):
         self.assertEqual(processed, data)
         
 
+class ColumnarCollectionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class Tag(micromodels.Model):
+            name = micromodels.CharField()
+
+        class Row(micromodels.Model):
+            id = micromodels.IntegerField()
+            price = micromodels.FloatField()
+            active = micromodels.BooleanField()
+            label = micromodels.CharField()
+            tag = micromodels.ModelField(Tag, related_name='row')
+
+        class Table(micromodels.Model):
+            rows = micromodels.ModelCollectionField(Row, columnar=True,
+                                                    related_name='table')
+
+        self.Row = Row
+        self.Table = Table
+        self.data = {'rows': [
+            {'id': 1, 'price': '1.5', 'active': 'true', 'label': u'a',
+             'tag': {'name': 'x'}},
+            {'id': '2', 'price': 2, 'active': 0, 'label': u'a'},
+            {'price': 3.25, 'label': u'b', 'ignored': True},
+        ]}
+
+    def test_rows(self):
+        from micromodels.columns import ModelCollectionList
+        table = self.Table.from_dict(self.data)
+        rows = table.rows
+        self.assertTrue(isinstance(rows, ModelCollectionList))
+        self.assertEqual(len(rows), 3)
+        first = rows[0]
+        self.assertTrue(isinstance(first, self.Row))
+        self.assertEqual(first.to_dict(serial=True),
+                         {'id': 1, 'price': 1.5, 'active': True,
+                          'label': u'a', 'tag': {'name': u'x'}})
+        self.assertEqual(first.table, table)
+        self.assertEqual(first.tag.row, first)
+        self.assertEqual(rows[-1].to_dict(), {'price': 3.25, 'label': u'b'})
+        self.assertEqual([row.id for row in rows[:2]], [1, 2])
+        self.assertEqual([row.label for row in rows], [u'a', u'a', u'b'])
+        self.assertRaises(IndexError, lambda: rows[3])
+
+    def test_columns(self):
+        from array import array
+        rows = self.Table.from_dict(self.data).rows
+        self.assertEqual(rows.column('price'), array('d', [1.5, 2.0, 3.25]))
+        self.assertEqual(list(rows.column('active')), [1, 0, 0])
+        labels = rows.column('label')
+        self.assertTrue(labels[0] is labels[1])
+        self.assertEqual([tag and tag.name for tag in rows.column('tag')],
+                         ['x', None, None])
+
+    def test_serialization(self):
+        class Plain(micromodels.Model):
+            rows = micromodels.ModelCollectionField(self.Row)
+
+        table = self.Table.from_dict(self.data)
+        expected = Plain.from_dict(self.data).to_dict(serial=True)
+        self.assertEqual(table.to_dict(serial=True), expected)
+        self.assertEqual(json.loads(table.to_json()), expected)
+
+    def test_large_integers(self):
+        rows = self.Table.from_dict({'rows': [{'id': 1}, {'id': 2 ** 80},
+                                              {'id': '3'}]}).rows
+        self.assertEqual(list(rows.column('id')), [1, 2 ** 80, 3])
+
+    def test_to_numpy(self):
+        from micromodels import columns
+        rows = self.Table.from_dict(self.data).rows
+        if columns.numpy is None:
+            self.assertRaises(ImportError, rows.to_numpy, 'price')
+        else:
+            self.assertEqual(list(rows.to_numpy('price')), [1.5, 2.0, 3.25])
+            self.assertEqual(rows.to_numpy('active').dtype, bool)
+
+
+class LazyCollectionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conversions = conversions = []
+
+        class Item(micromodels.Model):
+            id = micromodels.IntegerField()
+
+            @classmethod
+            def from_dict(cls, D, is_json=False, lazy=None):
+                conversions.append(D)
+                return super(Item, cls).from_dict(D, is_json, lazy)
+
+        class Page(micromodels.Model):
+            items = micromodels.ModelCollectionField(Item, lazy=True,
+                                                     related_name='page')
+            tags = micromodels.FieldCollectionField(micromodels.CharField(),
+                                                    lazy=True)
+
+        self.Item = Item
+        self.Page = Page
+        self.data = {'items': [{'id': i} for i in range(100)],
+                     'tags': ['a', 'b', 3]}
+
+    def test_conversion_on_access(self):
+        from micromodels.sequences import LazyList
+        page = self.Page.from_dict(self.data)
+        self.assertTrue(isinstance(page.items, LazyList))
+        self.assertEqual(len(page.items), 100)
+        self.assertEqual(self.conversions, [])
+        first = page.items[0]
+        self.assertTrue(isinstance(first, self.Item))
+        self.assertEqual(first.page, page)
+        self.assertTrue(page.items[0] is first)
+        self.assertEqual([item.id for item in page.items[-2:]], [98, 99])
+        self.assertEqual(len(self.conversions), 3)
+        self.assertEqual(page.items.converted(), 3)
+        self.assertEqual(page.tags, [u'a', u'b', u'3'])
+        self.assertRaises(IndexError, lambda: page.items[100])
+
+    def test_serialization(self):
+        page = self.Page.from_dict(self.data)
+        page.items[1].id = 42
+        expected = {'items': [{'id': i} for i in range(100)],
+                    'tags': [u'a', u'b', u'3']}
+        expected['items'][1]['id'] = 42
+        self.assertEqual(page.to_dict(serial=True), expected)
+        self.assertEqual(json.loads(page.to_json()), expected)
+        self.assertEqual(len(self.conversions), 1)
+
+    def test_stream(self):
+        from StringIO import StringIO
+        page = self.Page.from_json_stream(StringIO(json.dumps(self.data)))
+        self.assertEqual(page.items.converted(), 0)
+        self.assertEqual(page.items[5].id, 5)
+
+    def test_columnar_and_lazy(self):
+        self.assertRaises(TypeError, micromodels.ModelCollectionField,
+                          self.Item, columnar=True, lazy=True)
+
+    def test_pickling(self):
+        import copy
+        import pickle
+        diary = PickledDiary.from_dict({'people': [
+            {'name': 'Eric', 'born': '1990-02-03'}, {'name': 'John'}]})
+        diary.people[1].name = 'Graham'
+        copies = [pickle.loads(pickle.dumps(diary, protocol))
+                  for protocol in range(pickle.HIGHEST_PROTOCOL + 1)]
+        copies.append(copy.deepcopy(diary))
+        for other in copies:
+            self.assertEqual(other.people.converted(), 1)
+            self.assertEqual(other.people[0].born, date(1990, 2, 3))
+            self.assertTrue(other.people[0].diary is other)
+            self.assertTrue(other.people[1].diary is other)
+            self.assertEqual(other.to_dict(serial=True),
+                             diary.to_dict(serial=True))
+
+
+class IncrementalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class Author(micromodels.Model):
+            name = micromodels.CharField()
+
+        class Page(micromodels.Model):
+            title = micromodels.CharField()
+            author = micromodels.ModelField(Author, related_name='page')
+            people = micromodels.ModelCollectionField(PickledPerson,
+                                                      related_name='page')
+            tags = micromodels.FieldCollectionField(micromodels.CharField())
+
+        self.Page = Page
+        self.data = {'title': 'Results', 'author': {'name': 'Eric'},
+                     'people': [{'name': str(n), 'born': '2000-01-01'}
+                                for n in range(10)],
+                     'tags': ['a', 'b']}
+
+    def test_decode(self):
+        decode = self.Page.from_dict_incremental(self.data, slice_size=3)
+        self.assertEqual(decode.result, None)
+        steps = list(decode)
+        self.assertEqual(steps, [None] * len(steps))
+        self.assertEqual(len(steps), 4)
+        page = decode.result
+        self.assertEqual(page.to_dict(serial=True),
+                         self.Page.from_dict(self.data).to_dict(serial=True))
+        self.assertEqual(page.author.page, page)
+        self.assertEqual(page.people[9].page, page)
+
+    def test_decode_with_executor(self):
+        import pickle
+
+        class Future(object):
+            def __init__(self, result):
+                self._result = result
+
+            def result(self):
+                return self._result
+
+        class Executor(object):
+            def submit(self, fn, *args):
+                # Results cross a process boundary in real executors.
+                return Future(pickle.loads(pickle.dumps(fn(*args), 2)))
+
+        decode = self.Page.from_dict_incremental(json.dumps(self.data),
+                                                 is_json=True, slice_size=4,
+                                                 executor=Executor())
+        futures = [step for step in decode if step is not None]
+        self.assertEqual(len(futures), 3)
+        page = decode.result
+        self.assertEqual([p.name for p in page.people],
+                         [str(n) for n in range(10)])
+        self.assertEqual(page.people[0].born, date(2000, 1, 1))
+        self.assertEqual(page.people[0].page, page)
+
+        class Street(micromodels.Model):
+            families = micromodels.ModelCollectionField(PickledFamily)
+
+        data = {'families': [{'name': str(n), 'kids': [{'name': 'a'}]}
+                             for n in range(5)]}
+        decode = Street.from_dict_incremental(data, slice_size=2,
+                                              executor=Executor())
+        list(decode)
+        for family in decode.result.families:
+            self.assertTrue(family.kids[0].parent is family)
+
+    def test_encode(self):
+        page = self.Page.from_dict(self.data)
+        pieces = list(page.to_json_pieces(slice_size=4))
+        self.assertEqual(len(pieces), 6)
+        self.assertEqual(json.loads(''.join(pieces)),
+                         json.loads(page.to_json()))
+        lazy = self.Page.from_dict(self.data, lazy=True)
+        self.assertEqual(json.loads(''.join(lazy.to_json_pieces(3))),
+                         json.loads(page.to_json()))
+        self.assertEqual(list(self.Page().to_json_pieces()), ['{}'])
+
+
 class FieldCollectionFieldTestCase(unittest.TestCase):
 
     def test_field_collection_field_creation(self):
@@ -449,6 +974,1110 @@ class FieldCollectionFieldTestCase(unittest.TestCase):
         self.assertEqual(serial['aliases'], data['aliases'])
         self.assertEqual(serial['events'][0], '01-30-2011')
 
+class CompactModelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class Point(micromodels.Model):
+            x = micromodels.IntegerField()
+            y = micromodels.IntegerField()
+            label = micromodels.CharField()
+
+        class CompactPoint(micromodels.Model):
+            __compact__ = True
+            x = micromodels.IntegerField()
+            y = micromodels.IntegerField()
+            label = micromodels.CharField()
+
+        self.Point = Point
+        self.CompactPoint = CompactPoint
+        self.data = {'x': 1, 'y': '2', 'label': 'origin'}
+
+    def test_values_stored_in_slots(self):
+        point = self.CompactPoint.from_dict(self.data)
+        self.assertEqual(point.to_dict(), {'x': 1, 'y': 2, 'label': 'origin'})
+        self.assertEqual(vars(point), {})
+        point.y = '5'
+        self.assertEqual(point.y, 5)
+        self.assertEqual(vars(point), {})
+
+    def test_missing_values(self):
+        point = self.CompactPoint.from_dict({'x': 1})
+        self.assertFalse(hasattr(point, 'y'))
+        self.assertEqual(point.to_dict(serial=True), {'x': 1})
+
+    def test_add_field(self):
+        point = self.CompactPoint.from_dict(self.data)
+        point.add_field('z', '3', micromodels.IntegerField())
+        self.assertEqual(point.z, 3)
+        self.assertEqual(point.to_dict()['z'], 3)
+        self.assertEqual(self.CompactPoint()._extra, {})
+
+    def test_smaller_than_regular_instances(self):
+        import sys
+        regular = self.Point.from_dict(self.data)
+        compact = self.CompactPoint.from_dict(self.data)
+        regular_size = sys.getsizeof(regular) + sys.getsizeof(vars(regular))
+        self.assertTrue(sys.getsizeof(compact) < regular_size)
+
+
+class LazyModelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        converted = self.converted = []
+
+        class CountingField(micromodels.IntegerField):
+            def convert(self, value, context=None):
+                converted.append(value)
+                return super(CountingField, self).convert(value, context)
+
+        class Author(micromodels.Model):
+            name = micromodels.CharField()
+
+            @classmethod
+            def from_dict(cls, *args, **kwargs):
+                converted.append('author')
+                return super(Author, cls).from_dict(*args, **kwargs)
+
+        class Post(micromodels.Model):
+            title = micromodels.CharField()
+            views = CountingField()
+            published = micromodels.DateField(format='%Y-%m-%d')
+            author = micromodels.ModelField(Author, related_name='post')
+            tags = micromodels.FieldCollectionField(micromodels.CharField())
+            replies = micromodels.ModelCollectionField(Author)
+
+        self.Post = Post
+        self.data = {'title': u'Hello', 'views': '10',
+                     'published': '2011-04-01',
+                     'author': {'name': u'Eric', 'age': 3},
+                     'tags': [u'a', u'b'], 'replies': [{'name': u'John'}]}
+
+    def test_converted_on_first_access(self):
+        post = self.Post.from_dict(self.data, lazy=True)
+        self.assertEqual(self.converted, [])
+        self.assertEqual(post.views, 10)
+        self.assertEqual(post.views, 10)
+        self.assertEqual(self.converted, ['10'])
+        self.assertEqual(post.author.post, post)
+        self.assertFalse(hasattr(post, 'missing'))
+
+    def test_to_dict_matches_eager(self):
+        eager = self.Post.from_dict(self.data)
+        del self.converted[:]
+        post = self.Post.from_dict(self.data, lazy=True)
+        self.assertEqual(post.to_dict(serial=True), eager.to_dict(serial=True))
+        self.assertEqual(post.to_json(), eager.to_json())
+        self.assertEqual(self.converted, ['10', '10'])
+        self.assertEqual(post.to_dict()['author'].name, 'Eric')
+        self.assertEqual(post.to_dict(serial=True), eager.to_dict(serial=True))
+
+    def test_assignment_replaces_raw_value(self):
+        post = self.Post.from_dict(self.data, lazy=True)
+        post.views = '11'
+        self.assertEqual(post.to_dict(serial=True)['views'], 11)
+        post.set_data({'title': 'Other'})
+        self.assertEqual(post.to_dict(serial=True)['title'], 'Other')
+
+    def test_class_default(self):
+        class LazyPost(micromodels.Model):
+            __lazy__ = True
+            views = micromodels.IntegerField()
+
+        post = LazyPost.from_dict({'views': '3'})
+        self.assertEqual(post._raw, {'views': '3'})
+        self.assertEqual(post.views, 3)
+        self.assertEqual(post._raw, {})
+        self.assertEqual(LazyPost.from_dict({'views': '3'}, lazy=False)._raw, {})
+        for post in LazyPost.from_dicts([{'views': '3'}]):
+            self.assertEqual(post._raw, {'views': '3'})
+            self.assertEqual(post.views, 3)
+
+    def test_copies_convert_separately(self):
+        import copy
+        post = self.Post.from_dict(self.data, lazy=True)
+        other = copy.copy(post)
+        self.assertEqual(other.views, 10)
+        self.assertEqual(post.views, 10)
+        self.assertEqual(self.converted, ['10', '10'])
+        self.assertTrue('title' in post._raw)
+        self.assertFalse(other._raw is post._raw)
+
+    def test_compact_models_cannot_be_lazy(self):
+        class CompactPost(micromodels.Model):
+            __compact__ = True
+            views = micromodels.IntegerField()
+
+        self.assertRaises(TypeError, CompactPost.from_dict, {}, lazy=True)
+
+
+class ChangeTrackingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class User(micromodels.Model):
+            id = micromodels.IntegerField()
+            name = micromodels.CharField()
+
+        class Post(micromodels.Model):
+            title = micromodels.CharField()
+            published = micromodels.DateField(format='%Y-%m-%d')
+            author = micromodels.ModelField(User)
+            replies = micromodels.ModelCollectionField(User)
+
+        self.Post = Post
+        self.data = {'title': u'Hello', 'published': '2011-04-01',
+                     'author': {'id': 1, 'name': u'Eric'},
+                     'replies': [{'id': 2, 'name': u'John'}]}
+
+    def test_patch(self):
+        post = self.Post.from_dict(self.data)
+        self.assertFalse(post.is_dirty())
+        self.assertEqual(post.to_patch(), {})
+        post.title = 'Other'
+        post.author.name = 'Graham'
+        self.assertTrue(post.is_dirty())
+        self.assertEqual(post.to_patch(), {'title': u'Other',
+                                           'author': {'name': u'Graham'}})
+        post.replies[0].id = 3
+        self.assertEqual(post.to_patch()['replies'],
+                         [{'id': 3, 'name': u'John'}])
+        post.mark_clean()
+        self.assertFalse(post.is_dirty())
+        self.assertEqual(post.to_patch(), {})
+
+    def test_set_data_and_lazy_decoding(self):
+        post = self.Post.from_kwargs(title='Hello')
+        self.assertEqual(post.to_patch(), {'title': u'Hello'})
+        post = self.Post.from_dict(self.data, lazy=True)
+        self.assertEqual(post.title, u'Hello')
+        self.assertEqual(post.to_patch(), {})
+
+    def test_lazy_collections(self):
+        class Page(micromodels.Model):
+            items = micromodels.ModelCollectionField(self.Post, lazy=True)
+
+        page = Page.from_dict({'items': [self.data, self.data]})
+        self.assertFalse(page.is_dirty())
+        page.items[1].author.id = 2
+        self.assertTrue(page.is_dirty())
+        patch = page.to_patch()
+        self.assertEqual([item['author']['id'] for item in patch['items']],
+                         [1, 2])
+        page.mark_clean()
+        self.assertFalse(page.items[1].is_dirty())
+        self.assertEqual(page.to_patch(), {})
+
+    def test_serialized_values_are_cached(self):
+        post = self.Post.from_dict(self.data)
+        expected = post.to_dict(serial=True)
+        self.assertEqual(post._serial, {'published': '2011-04-01'})
+        self.assertEqual(post.to_json(), json.dumps(expected))
+        post.published = '2012-05-06'
+        self.assertEqual(post._serial, {})
+        self.assertEqual(post.to_dict(serial=True)['published'],
+                         '2012-05-06')
+        from StringIO import StringIO
+        stream = StringIO()
+        post.to_json(stream)
+        self.assertEqual(json.loads(stream.getvalue())['published'],
+                         '2012-05-06')
+
+    def test_compact_models(self):
+        class CompactUser(micromodels.Model):
+            __compact__ = True
+            id = micromodels.IntegerField()
+
+        user = CompactUser.from_dict({'id': 1})
+        self.assertEqual(user.to_patch(), {})
+        user.id = 2
+        self.assertEqual(user.to_patch(), {'id': 2})
+        self.assertEqual(vars(user), {})
+
+    def test_copies_track_changes_separately(self):
+        import copy
+        post = self.Post.from_dict(self.data)
+        post.title = 'Other'
+        self.assertEqual(post.to_dict(serial=True)['published'], '2011-04-01')
+        other = copy.copy(post)
+        other.published = '2012-05-06'
+        other.add_field('note', u'New', micromodels.CharField())
+        self.assertEqual(other.to_dict(serial=True)['published'],
+                         '2012-05-06')
+        self.assertEqual(post.to_dict(serial=True)['published'],
+                         '2011-04-01')
+        self.assertEqual(post.to_patch(), {'title': u'Other'})
+        self.assertFalse('note' in post.to_dict())
+        self.assertEqual(other.to_patch()['note'], u'New')
+
+
+class DecodeCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from micromodels.cache import DecodeCache
+        self.DecodeCache = DecodeCache
+        self.converted = converted = []
+
+        class CountingField(micromodels.IntegerField):
+            def convert(self, value, context=None):
+                converted.append(value)
+                return super(CountingField, self).convert(value, context)
+
+        class Author(micromodels.Model):
+            name = micromodels.CharField()
+
+        class Post(micromodels.Model):
+            views = CountingField()
+            author = micromodels.ModelField(Author, related_name='post')
+            tags = micromodels.FieldCollectionField(micromodels.CharField())
+
+        self.Post = Post
+        self.payload = json.dumps({'views': 1, 'author': {'name': 'Eric'},
+                                   'tags': ['a']})
+
+    def test_hits_return_copies(self):
+        cache = self.DecodeCache()
+        first = self.Post.from_dict(self.payload, is_json=True, cache=cache)
+        second = self.Post.from_dict(self.payload, is_json=True, cache=cache)
+        self.assertEqual(self.converted, [1])
+        self.assertEqual(second.to_dict(serial=True),
+                         first.to_dict(serial=True))
+        self.assertFalse(second is first)
+        self.assertFalse(second.author is first.author)
+        self.assertTrue(second.author.post is second)
+        second.tags.append('b')
+        second.author.name = 'John'
+        second.add_field('extra', 1, micromodels.IntegerField())
+        third = self.Post.from_dict(self.payload, is_json=True, cache=cache)
+        self.assertEqual(third.to_dict(serial=True),
+                         first.to_dict(serial=True))
+        self.assertEqual(third._extra, {})
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'size': 1,
+                                         'maxsize': 1000, 'expired': 0})
+
+    def test_lazy_collections_are_copied(self):
+        class Item(micromodels.Model):
+            id = micromodels.IntegerField()
+
+        class Page(micromodels.Model):
+            items = micromodels.ModelCollectionField(Item, lazy=True,
+                                                     related_name='page')
+
+        cache = self.DecodeCache()
+        text = json.dumps({'items': [{'id': 1}, {'id': 2}]})
+        first = Page.from_dict(text, is_json=True, cache=cache)
+        first.items[0].id = 100
+        second = Page.from_dict(text, is_json=True, cache=cache)
+        second.items[1].id = 200
+        third = Page.from_dict(text, is_json=True, cache=cache)
+        self.assertEqual([item.id for item in third.items], [1, 2])
+        self.assertTrue(third.items[0].page is third)
+        self.assertEqual([item.id for item in second.items], [1, 200])
+
+    def test_columnar_collections_are_copied(self):
+        class Row(micromodels.Model):
+            id = micromodels.IntegerField()
+
+        class Table(micromodels.Model):
+            rows = micromodels.ModelCollectionField(Row, columnar=True,
+                                                    related_name='table')
+
+        cache = self.DecodeCache()
+        text = json.dumps({'rows': [{'id': 1}]})
+        first = Table.from_dict(text, is_json=True, cache=cache)
+        first.rows.append({'id': 2})
+        second = Table.from_dict(text, is_json=True, cache=cache)
+        self.assertEqual([row.id for row in second.rows], [1])
+        self.assertTrue(second.rows[0].table is second)
+
+    def test_empty_projections(self):
+        cache = self.DecodeCache()
+        for options in ({'only': []}, {'exclude': []}):
+            self.Post.from_dict(self.payload, is_json=True, cache=cache,
+                                **options)
+            post = self.Post.from_dict(self.payload, is_json=True,
+                                       cache=cache, **options)
+        self.assertEqual(post.views, 1)
+        self.assertFalse(hasattr(self.Post.from_dict(
+            self.payload, is_json=True, cache=cache, only=[]), 'views'))
+
+    def test_options_and_class_default(self):
+        cache = self.DecodeCache(shared=True)
+        self.Post.__cache__ = cache
+        try:
+            first = self.Post.from_dict(self.payload, is_json=True)
+            self.assertTrue(
+                self.Post.from_dict(self.payload, is_json=True) is first)
+            lazy = self.Post.from_dict(self.payload, is_json=True, lazy=True)
+            self.assertFalse(lazy is first)
+            self.Post.from_dict({'views': 1})
+            self.assertEqual(len(cache), 2)
+        finally:
+            del self.Post.__cache__
+
+    def test_invalidation_and_expiry(self):
+        now = [0]
+        cache = self.DecodeCache(ttl=60, timer=lambda: now[0])
+        self.Post.from_dict(self.payload, is_json=True, cache=cache)
+        self.Post.from_dict(u'{"views": 2}', is_json=True, cache=cache)
+        cache.invalidate(self.Post, self.payload)
+        self.assertEqual(len(cache), 1)
+        now[0] = 61
+        self.Post.from_dict(u'{"views": 2}', is_json=True, cache=cache)
+        self.assertEqual(cache.stats()['expired'], 1)
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(self.converted, [1, 2, 2])
+
+
+class ProjectionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class User(micromodels.Model):
+            id = micromodels.IntegerField()
+            screen_name = micromodels.CharField()
+            created = micromodels.DateField(format='%Y-%m-%d')
+
+        class Tweet(micromodels.Model):
+            id = micromodels.IntegerField()
+            text = micromodels.CharField()
+            user = micromodels.ModelField(User, related_name='tweet')
+            mentions = micromodels.ModelCollectionField(User)
+
+        self.Tweet = Tweet
+        self.data = {'id': '1', 'text': u'Hello',
+                     'user': {'id': '2', 'screen_name': u'eric',
+                              'created': '2011-04-01'},
+                     'mentions': [{'id': '3', 'screen_name': u'john'}]}
+
+    def test_only(self):
+        tweet = self.Tweet.from_dict(self.data,
+                                     only=['id', 'user.screen_name'])
+        self.assertEqual(tweet.id, 1)
+        self.assertEqual(tweet.user.screen_name, 'eric')
+        self.assertEqual(tweet.user.tweet, tweet)
+        self.assertFalse(hasattr(tweet, 'text'))
+        self.assertFalse(hasattr(tweet.user, 'id'))
+        self.assertEqual(tweet.raw_value('text'), u'Hello')
+        self.assertEqual(tweet.user.raw_value('created'), '2011-04-01')
+        self.assertRaises(KeyError, tweet.raw_value, 'id')
+        self.assertEqual(tweet.to_dict(), {'id': 1, 'user': tweet.user})
+
+    def test_whole_field_wins_over_nested_paths(self):
+        tweet = self.Tweet.from_dict(self.data, only=['user.id', 'user'])
+        self.assertEqual(tweet.user.created, date(2011, 4, 1))
+
+    def test_exclude(self):
+        tweet = self.Tweet.from_dict(self.data,
+                                     exclude=['text', 'mentions.id'])
+        self.assertFalse(hasattr(tweet, 'text'))
+        self.assertEqual(tweet.user.id, 2)
+        self.assertEqual(tweet.mentions[0].screen_name, 'john')
+        self.assertFalse(hasattr(tweet.mentions[0], 'id'))
+        self.assertEqual(tweet.mentions[0].raw_value('id'), '3')
+
+    def test_assignment_replaces_skipped_value(self):
+        tweet = self.Tweet.from_dict(self.data, only=['id'])
+        tweet.text = 'Other'
+        self.assertRaises(KeyError, tweet.raw_value, 'text')
+        self.assertEqual(self.Tweet.from_dict(self.data)._skipped, {})
+
+    def test_compiled_once(self):
+        from micromodels.cache import LRUCache
+        projections = self.Tweet._projections
+        self.Tweet.from_dict(self.data, only=['user.id', 'id'])
+        count = len(projections)
+        self.Tweet.from_dict(self.data, only=['id', 'user.id'])
+        self.assertEqual(len(projections), count)
+        self.assertTrue(isinstance(projections, LRUCache))
+
+    def test_classes_are_not_kept(self):
+        import gc
+        import weakref
+
+        class Short(micromodels.Model):
+            id = micromodels.IntegerField()
+
+        Short.from_dict({'id': 1}, only=['id'])
+        ref = weakref.ref(Short)
+        del Short
+        gc.collect()
+        self.assertTrue(ref() is None)
+
+    def test_invalid_projections(self):
+        class Other(micromodels.Model):
+            tags = micromodels.FieldCollectionField(micromodels.CharField())
+
+        self.assertRaises(ValueError, self.Tweet.from_dict, {},
+                          only=['missing'])
+        self.assertRaises(ValueError, self.Tweet.from_dict, {},
+                          only=['user.missing'])
+        self.assertRaises(ValueError, Other.from_dict, {}, only=['tags.x'])
+        self.assertRaises(TypeError, self.Tweet.from_dict, {},
+                          only=['id'], lazy=True)
+
+
+class IdentityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class User(micromodels.Model):
+            id = micromodels.IntegerField()
+            name = micromodels.CharField()
+
+        class Tweet(micromodels.Model):
+            text = micromodels.CharField()
+            user = micromodels.ModelField(User, identity='id')
+
+        class Timeline(micromodels.Model):
+            tweets = micromodels.ModelCollectionField(Tweet)
+
+        self.User = User
+        self.Tweet = Tweet
+        self.Timeline = Timeline
+        self.data = {'tweets': [{'text': u'%d' % i,
+                                 'user': {'id': i % 2, 'name': u'eric'}}
+                                for i in range(4)]}
+
+    def users(self, tweets):
+        return len(set(id(tweet.user) for tweet in tweets))
+
+    def test_shared_within_a_decode(self):
+        timeline = self.Timeline.from_dict(self.data)
+        self.assertEqual(self.users(timeline.tweets), 2)
+        self.assertEqual(timeline.tweets[2].user.id, 0)
+        other = self.Timeline.from_dict(self.data)
+        self.assertFalse(other.tweets[0].user is timeline.tweets[0].user)
+        self.assertTrue(self.Timeline._shares_identity)
+        self.assertFalse(self.User._shares_identity)
+
+    def test_shared_within_a_batch(self):
+        from StringIO import StringIO
+        tweets = list(self.Tweet.from_dicts(self.data['tweets']))
+        self.assertEqual(self.users(tweets), 2)
+        stream = StringIO(json.dumps(self.data))
+        tweets = list(self.Timeline.iter_json(stream, 'tweets'))
+        self.assertEqual(self.users(tweets), 2)
+        stream = StringIO(json.dumps(self.data))
+        timeline = self.Timeline.from_json_stream(stream)
+        self.assertEqual(self.users(timeline.tweets), 2)
+
+    def test_explicit_identity_map(self):
+        from micromodels.identity import IdentityMap, current
+        with IdentityMap(max_size=1) as identity_map:
+            tweets = [self.Tweet.from_dict(data)
+                      for data in self.data['tweets']]
+            self.assertTrue(current() is identity_map)
+        self.assertTrue(current() is None)
+        self.assertEqual(self.users(tweets), 4)
+        self.assertEqual(len(identity_map), 1)
+        with IdentityMap() as identity_map:
+            first = self.Tweet.from_dict(self.data['tweets'][0])
+            second = self.Tweet.from_dict(self.data['tweets'][2])
+        self.assertTrue(first.user is second.user)
+        self.assertEqual(identity_map.stats()['hits'], 1)
+
+    def test_missing_or_unhashable_identity(self):
+        class Tag(micromodels.Model):
+            key = micromodels.BaseField()
+
+        class Post(micromodels.Model):
+            tag = micromodels.ModelField(Tag, identity='key')
+
+        class Feed(micromodels.Model):
+            posts = micromodels.ModelCollectionField(Post)
+
+        posts = [{'tag': {}}, {'tag': {}},
+                 {'tag': {'key': [1]}}, {'tag': {'key': [1]}}]
+        feed = Feed.from_dict({'posts': posts})
+        self.assertEqual(len(set(id(post.tag) for post in feed.posts)), 4)
+
+    def test_invalid_declarations(self):
+        self.assertRaises(ValueError, micromodels.ModelField, self.User,
+                          identity='missing')
+        self.assertRaises(TypeError, micromodels.ModelField, self.User,
+                          identity='id', related_name='tweet')
+
+
+class StreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class Item(micromodels.Model):
+            name = micromodels.CharField()
+            price = micromodels.FloatField()
+
+        class Order(micromodels.Model):
+            id = micromodels.IntegerField()
+            items = micromodels.ModelCollectionField(Item, related_name='order')
+            buyer = micromodels.ModelField(Item, source='customer')
+            tags = micromodels.FieldCollectionField(micromodels.CharField())
+
+        self.Item = Item
+        self.Order = Order
+        self.data = {
+            'id': 7,
+            'ignored': {'deep': ['x', {'y': '}]\\"'}], 'n': [1, 2.5e3, None]},
+            'items': [{'name': 'a', 'price': 1.5, 'extra': [1, 2]},
+                      {'name': u'b\u00e9"', 'price': 2}],
+            'customer': {'name': 'c', 'unused': True},
+            'tags': ['x', u'\u00ff'],
+            'trailing': 'value',
+        }
+
+    def reader(self, data, chunk_size=1):
+        from StringIO import StringIO
+        from micromodels.stream import JSONStreamReader
+        return JSONStreamReader(StringIO(json.dumps(data)), chunk_size)
+
+    def test_read_model(self):
+        from micromodels.stream import read_model
+        for chunk_size in (1, 3, 4096):
+            order = read_model(self.reader(self.data, chunk_size), self.Order)
+            expected = self.Order.from_dict(self.data)
+            self.assertEqual(order.to_dict(serial=True),
+                             expected.to_dict(serial=True))
+            self.assertEqual(order.items[0].order, order)
+            self.assertFalse(hasattr(order.buyer, 'unused'))
+
+    def test_from_json_stream(self):
+        from StringIO import StringIO
+        order = self.Order.from_json_stream(StringIO(json.dumps(self.data)))
+        self.assertEqual(order.id, 7)
+        self.assertEqual([item.name for item in order.items], ['a', u'b\u00e9"'])
+
+    def test_iter_json_array(self):
+        from StringIO import StringIO
+        stream = StringIO(json.dumps(self.data['items']))
+        items = self.Item.iter_json(stream)
+        self.assertEqual(next(items).name, 'a')
+        self.assertEqual([item.price for item in items], [2.0])
+
+    def test_iter_json_collection(self):
+        from StringIO import StringIO
+        stream = StringIO(json.dumps(self.data))
+        items = list(self.Order.iter_json(stream, 'items'))
+        self.assertEqual([item.price for item in items], [1.5, 2.0])
+        self.assertRaises(TypeError, list,
+                          self.Order.iter_json(stream, 'buyer'))
+
+    def test_empty_containers_and_scalars(self):
+        from micromodels.stream import read_model
+        order = read_model(self.reader({'items': [], 'id': 3}), self.Order)
+        self.assertEqual(order.items, [])
+        self.assertEqual(order.id, 3)
+
+    def test_truncated_stream(self):
+        from StringIO import StringIO
+        stream = StringIO(json.dumps(self.data)[:-10])
+        self.assertRaises(ValueError, self.Order.from_json_stream, stream)
+
+    def test_from_buffer(self):
+        expected = self.Order.from_dict(self.data).to_dict(serial=True)
+        text = json.dumps(self.data, ensure_ascii=False).encode('utf-8')
+        for data in (text, text.decode('utf-8'), bytearray(text),
+                     memoryview(text)):
+            order = self.Order.from_buffer(data)
+            self.assertEqual(order.to_dict(serial=True), expected)
+        self.assertRaises(ValueError, self.Order.from_buffer, text[:-10])
+        self.assertEqual(self.Order.from_buffer(text + ' \n').to_dict(
+            serial=True), expected)
+        for data in (text + ' garbage', bytearray(text + '{}')):
+            self.assertRaises(ValueError, self.Order.from_buffer, data)
+
+    def test_from_file(self):
+        import os
+        import tempfile
+        descriptor, path = tempfile.mkstemp()
+        try:
+            os.write(descriptor, json.dumps(self.data))
+            os.close(descriptor)
+            order = self.Order.from_file(path)
+            self.assertEqual(order.to_dict(serial=True),
+                             self.Order.from_dict(self.data).to_dict(serial=True))
+            open(path, 'wb').close()
+            try:
+                self.Order.from_file(path)
+            except ValueError as error:
+                self.assertEqual(str(error), 'Unexpected end of JSON document')
+            else:
+                self.fail('ValueError not raised')
+        finally:
+            os.remove(path)
+
+
+class JSONEncodingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class Author(micromodels.Model):
+            name = micromodels.CharField()
+            born = micromodels.DateField(format='%Y-%m-%d')
+
+        class SummaryField(micromodels.ModelField):
+            def to_serial(self, model_instance):
+                return model_instance.name
+
+        class Post(micromodels.Model):
+            title = micromodels.CharField()
+            score = micromodels.FloatField()
+            author = micromodels.ModelField(Author)
+            editor = SummaryField(Author)
+            comments = micromodels.ModelCollectionField(Author)
+            tags = micromodels.FieldCollectionField(micromodels.CharField())
+
+        self.Post = Post
+        self.data = {'title': u'Caf\xe9 "quoted"', 'score': 0.1,
+                     'author': {'name': 'Eric', 'born': '1980-01-02'},
+                     'editor': {'name': 'Jamie'},
+                     'comments': [{'name': 'a'}, {}],
+                     'tags': ['x', 'y']}
+
+    def encode(self, instance):
+        from StringIO import StringIO
+        stream = StringIO()
+        self.assertEqual(instance.to_json(stream), None)
+        return stream.getvalue()
+
+    def test_matches_to_dict(self):
+        post = self.Post.from_dict(self.data)
+        post.add_field('views', 3, micromodels.IntegerField())
+        expected = json.loads(post.to_json())
+        self.assertEqual(json.loads(self.encode(post)), expected)
+        self.assertEqual(expected['editor'], 'Jamie')
+        self.assertEqual(expected['views'], 3)
+
+    def test_lazy(self):
+        post = self.Post.from_dict(self.data, lazy=True)
+        self.assertEqual(json.loads(self.encode(post)),
+                         json.loads(post.to_json()))
+
+    def test_compact(self):
+        class Point(micromodels.Model):
+            __compact__ = True
+            x = micromodels.IntegerField()
+            y = micromodels.IntegerField()
+
+        point = Point.from_dict({'x': 1})
+        self.assertEqual(self.encode(point), '{"x": 1}')
+        self.assertEqual(vars(point), {})
+
+    def test_empty(self):
+        self.assertEqual(self.encode(self.Post()), '{}')
+        self.assertEqual(self.encode(self.Post.from_dict({'comments': []})),
+                         '{"comments": []}')
+
+
+class BackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from micromodels import backends
+        self.backends = backends
+        self.calls = calls = []
+
+        def loads(text):
+            calls.append('loads')
+            return json.loads(text)
+
+        def dumps(value):
+            calls.append('dumps')
+            return json.dumps(value)
+
+        self.recording = backends.Backend('recording', loads, dumps)
+
+        class Person(micromodels.Model):
+            name = micromodels.CharField()
+
+        self.Person = Person
+
+    def tearDown(self):
+        self.backends.set_default('json')
+
+    def test_default(self):
+        self.assertEqual(self.backends.default().name, json.__name__)
+        self.backends.set_default(self.recording)
+        person = self.Person.from_dict('{"name": "Eric"}', is_json=True)
+        person.set_data('{"name": "John"}', is_json=True)
+        self.assertEqual(person.to_json(), '{"name": "John"}')
+        list(self.Person.from_dicts(['{"name": "Eric"}'], is_json=True))
+        self.assertEqual(self.calls, ['loads', 'loads', 'dumps', 'loads'])
+
+    def test_per_model(self):
+        class Sorted(micromodels.Model):
+            __json__ = self.backends.get('json', sort_keys=True)
+            b = micromodels.CharField()
+            a = micromodels.CharField()
+
+        class Recorded(self.Person):
+            __json__ = self.recording
+
+        self.assertEqual(Sorted.from_dict({'b': 'x', 'a': 'y'}).to_json(),
+                         '{"a": "y", "b": "x"}')
+        Recorded.from_dict('{"name": "Eric"}', is_json=True).to_json()
+        self.Person.from_dict('{"name": "Eric"}', is_json=True).to_json()
+        self.assertEqual(self.calls, ['loads', 'dumps'])
+
+    def test_get(self):
+        self.assertTrue(self.backends.get('json') is self.backends.get('json'))
+        self.assertTrue('json' in self.backends.available())
+        self.assertTrue(self.backends.get('auto').name in
+                        self.backends.AUTO_ORDER + ('simplejson',))
+        self.assertRaises(ValueError, self.backends.get, 'yaml')
+
+    def test_auto_resolved_once(self):
+        backends = self.backends
+        factories = dict(backends.FACTORIES)
+        made = dict(backends._backends)
+        attempts = []
+
+        def missing(**options):
+            attempts.append(options)
+            raise ImportError
+
+        backends._backends.clear()
+        try:
+            for name in backends.AUTO_ORDER[:-1]:
+                backends.FACTORIES[name] = missing
+            self.assertEqual(backends.get('auto').name, json.__name__)
+            self.assertEqual(len(attempts), len(backends.AUTO_ORDER) - 1)
+            self.assertTrue(backends.get('auto') is backends.get('auto'))
+            self.assertEqual(len(attempts), len(backends.AUTO_ORDER) - 1)
+        finally:
+            backends.FACTORIES.update(factories)
+            backends._backends.clear()
+            backends._backends.update(made)
+
+
+class MessagePackTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from micromodels import binary
+        self.msgpack = binary.msgpack
+        self.converted = converted = []
+
+        class CountingField(micromodels.DateTimeField):
+            def convert(self, value, context=None):
+                converted.append(value)
+                return super(CountingField, self).convert(value, context)
+
+        class PriceField(micromodels.BaseField):
+            def convert(self, value, context=None):
+                from decimal import Decimal
+                return Decimal(value)
+
+            def to_serial(self, value):
+                return str(value)
+
+        class Author(micromodels.Model):
+            name = micromodels.CharField()
+
+        class Post(micromodels.Model):
+            title = micromodels.CharField()
+            price = PriceField()
+            created = CountingField()
+            published = micromodels.DateField(format='%Y-%m-%d')
+            at = micromodels.TimeField()
+            tags = micromodels.FieldCollectionField(micromodels.CharField())
+            author = micromodels.ModelField(Author, related_name='post')
+            replies = micromodels.ModelCollectionField(Author)
+            extra = micromodels.BaseField()
+
+        self.Post = Post
+        self.data = {'title': u'Hello', 'created': '2011-04-01T10:20:30Z',
+                     'published': '2011-04-01', 'at': '10:20:30',
+                     'tags': [u'a', 'b'], 'author': {'name': u'Eric'},
+                     'replies': [{'name': u'John'}], 'extra': {'a': [1]}}
+
+    def has_msgpack(self):
+        # Python 2.6's unittest cannot skip tests; they pass there instead.
+        if self.msgpack is None and hasattr(self, 'skipTest'):
+            self.skipTest('msgpack is not installed')
+        return self.msgpack is not None
+
+    def test_round_trip_without_conversion(self):
+        if not self.has_msgpack():
+            return
+        post = self.Post.from_dict(self.data)
+        del self.converted[:]
+        copy = self.Post.from_msgpack(post.to_msgpack())
+        self.assertEqual(self.converted, [])
+        self.assertEqual(copy.to_dict(serial=True),
+                         post.to_dict(serial=True))
+        self.assertEqual(copy.created, post.created)
+        self.assertEqual(copy.created.utcoffset(), post.created.utcoffset())
+        self.assertEqual(copy.author.post, copy)
+        self.assertTrue(isinstance(copy.replies[0], type(post.author)))
+        self.assertFalse(copy.is_dirty())
+
+    def test_raw_and_unpackable_values(self):
+        if not self.has_msgpack():
+            return
+        from decimal import Decimal
+        post = self.Post.from_dict(self.data, lazy=True)
+        post.price = '1.5'
+        copy = self.Post.from_msgpack(post.to_msgpack())
+        self.assertEqual(copy.title, u'Hello')
+        self.assertEqual(copy.price, Decimal('1.5'))
+        self.assertEqual(copy.to_dict(serial=True)['created'],
+                         '2011-04-01T10:20:30+00:00')
+
+    def repack(self, instance):
+        # Packing without msgpack itself, so these run where it is missing.
+        from micromodels import binary
+        return binary._build(type(instance), binary._packable(instance))
+
+    def test_lazy_collections_keep_their_source_items(self):
+        from micromodels.sequences import LazyList
+
+        class Person(micromodels.Model):
+            name = micromodels.CharField()
+
+        class Diary(micromodels.Model):
+            days = micromodels.FieldCollectionField(
+                micromodels.DateField('%Y-%m-%d', serial_format='%m-%d-%Y'),
+                lazy=True)
+            people = micromodels.ModelCollectionField(
+                Person, lazy=True, related_name='diary')
+
+        diary = Diary.from_dict({'days': ['2011-04-01', '2011-04-02'],
+                                 'people': [{'name': u'Eric'},
+                                            {'name': u'John'}]})
+        self.assertEqual(diary.days[0], date(2011, 4, 1))
+        diary.people[1].name = u'Graham'
+        copy = self.repack(diary)
+        self.assertTrue(isinstance(copy.days, LazyList))
+        self.assertEqual(copy.days.converted(), 1)
+        self.assertEqual(list(copy.days),
+                         [date(2011, 4, 1), date(2011, 4, 2)])
+        self.assertEqual(copy.to_dict(serial=True)['days'],
+                         ['04-01-2011', '04-02-2011'])
+        self.assertTrue(isinstance(copy.people, LazyList))
+        self.assertEqual([person.name for person in copy.people],
+                         [u'Eric', u'Graham'])
+        self.assertTrue(copy.people[0].diary is copy)
+        self.assertTrue(copy.people[1].diary is copy)
+
+    def test_compact_values_of_any_type(self):
+        class Point(micromodels.Model):
+            __compact__ = True
+            where = micromodels.BaseField()
+
+        copy = self.repack(Point.from_dict({'where': (1, 2)}))
+        self.assertEqual(copy.where, (1, 2))
+
+    def test_collections_and_tuples_through_msgpack(self):
+        if not self.has_msgpack():
+            return
+        from micromodels.columns import ModelCollectionList
+
+        class Point(micromodels.Model):
+            x = micromodels.IntegerField()
+
+        class Shape(micromodels.Model):
+            name = micromodels.BaseField()
+            days = micromodels.FieldCollectionField(
+                micromodels.DateField('%Y-%m-%d'), lazy=True)
+            points = micromodels.ModelCollectionField(Point, columnar=True)
+
+        shape = Shape.from_dict({'name': (u'a', 1), 'points': [{'x': 1}],
+                                 'days': ['2011-04-01', '2011-04-02']})
+        shape.days[1]
+        copy = Shape.from_msgpack(shape.to_msgpack())
+        self.assertEqual(copy.name, (u'a', 1))
+        self.assertEqual(copy.days.converted(), 1)
+        self.assertEqual(list(copy.days),
+                         [date(2011, 4, 1), date(2011, 4, 2)])
+        self.assertTrue(isinstance(copy.points, ModelCollectionList))
+        self.assertEqual(copy.to_dict(serial=True), shape.to_dict(serial=True))
+
+    def test_columnar_collections_stay_columnar(self):
+        from micromodels.columns import ModelCollectionList
+
+        class Row(micromodels.Model):
+            n = micromodels.IntegerField()
+            ok = micromodels.BooleanField()
+            name = micromodels.CharField()
+            on = micromodels.DateField('%Y-%m-%d')
+
+        class Table(micromodels.Model):
+            rows = micromodels.ModelCollectionField(Row, columnar=True,
+                                                    related_name='table')
+
+        table = Table.from_dict({'rows': [
+            {'n': 1, 'ok': True, 'name': u'a', 'on': '2011-04-01'},
+            {'n': 2, 'ok': False}]})
+        copy = self.repack(table)
+        self.assertTrue(isinstance(copy.rows, ModelCollectionList))
+        self.assertEqual(copy.to_dict(serial=True), table.to_dict(serial=True))
+        self.assertEqual(copy.rows[0].on, date(2011, 4, 1))
+        self.assertTrue(copy.rows[0].ok is True)
+        self.assertFalse(hasattr(copy.rows[1], 'name'))
+        self.assertTrue(copy.rows[1].table is copy)
+
+
+class InstrumentationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from micromodels import instrument
+        self.instrument = instrument
+
+        class Author(micromodels.Model):
+            name = micromodels.CharField()
+
+        class Post(micromodels.Model):
+            title = micromodels.CharField()
+            views = micromodels.IntegerField()
+            author = micromodels.ModelField(Author)
+
+        self.Author = Author
+        self.Post = Post
+
+    def tearDown(self):
+        self.instrument.disable()
+        self.instrument.reset()
+
+    def test_disabled(self):
+        methods = dict(micromodels.Model.__dict__)
+        self.instrument.enable()
+        self.instrument.disable()
+        for name in ('from_dict', 'to_dict', '__setattr__'):
+            self.assertTrue(micromodels.Model.__dict__[name] is methods[name])
+        self.Post.from_dict({'title': 'Hello'}).to_dict()
+        self.assertEqual(self.instrument.stats(), {})
+
+    def test_stats(self):
+        self.instrument.enable()
+        self.Post.from_dict({'title': 'Hello', 'views': '3',
+                             'author': {'name': 'Eric'}})
+        self.assertRaises(ValueError, self.Post.from_dict, {'views': 'x'})
+        post = self.Post.from_dict({'title': 'Lazy'}, lazy=True)
+        post.title
+        post.views = 4
+        post.to_dict(serial=True)
+
+        class Late(micromodels.Model):
+            value = micromodels.IntegerField()
+
+        Late.from_dict({'value': 1})
+        stats = self.instrument.stats()
+        Post = self.Post
+        self.assertEqual(stats[Post]['title']['calls'], 2)
+        self.assertEqual(stats[Post]['views']['calls'], 3)
+        self.assertEqual(stats[Post]['views']['errors'], 1)
+        self.assertEqual(stats[Post]['from_dict()']['calls'], 3)
+        self.assertEqual(stats[Post]['from_dict()']['errors'], 1)
+        self.assertEqual(stats[Post]['to_dict()']['calls'], 1)
+        self.assertEqual(stats[self.Author]['name']['calls'], 1)
+        self.assertEqual(stats[Late]['value']['calls'], 1)
+        self.assertTrue(stats[Post]['title']['seconds'] >= 0)
+        self.instrument.reset()
+        self.assertEqual(self.instrument.stats(), {})
+
+    def test_classes_with_the_same_name(self):
+        self.instrument.enable()
+
+        class Post(micromodels.Model):
+            title = micromodels.CharField()
+
+        Post.from_dict({'title': 'Other'})
+        self.Post.from_dict({'title': 'Hello'})
+        self.Post.from_dict({'title': 'Hello'})
+        stats = self.instrument.stats()
+        self.assertEqual(stats[Post]['title']['calls'], 1)
+        self.assertEqual(stats[self.Post]['title']['calls'], 2)
+
+
+class CodegenTestCase(unittest.TestCase):
+
+    def load(self, source):
+        namespace = {}
+        exec compile(source, '<generated>', 'exec') in namespace
+        return namespace
+
+    def test_from_samples(self):
+        from micromodels import codegen
+        samples = [
+            {'id': 1, 'userName': 'eric', 'score': 1, 'class': 'a',
+             'posted': '2012-01-01T10:00:00Z', 'day': '2012-01-01',
+             'tags': ['a'], 'comments': [{'text': 'hi', 'at': '10:00:00'}]},
+            {'id': 2, 'score': 2.5, 'day': '2012-01-02', 'tags': [],
+             'comments': [], 'extra': None},
+        ]
+        models = self.load(codegen.from_samples(samples, 'Post'))
+        Post = models['Post']
+        self.assertEqual(
+            dict((name, type(field).__name__)
+                 for name, field in Post._clsfields.items()),
+            {'id': 'IntegerField', 'user_name': 'CharField',
+             'score': 'FloatField', 'class_': 'CharField',
+             'posted': 'DateTimeField', 'day': 'DateField',
+             'tags': 'FieldCollectionField',
+             'comments': 'ModelCollectionField', 'extra': 'BaseField'})
+        self.assertEqual(Post._clsfields['user_name'].source, 'userName')
+        post = Post.from_dict(samples[0])
+        self.assertEqual(post.day, date(2012, 1, 1))
+        self.assertEqual(post.comments[0].at.hour, 10)
+        self.assertEqual(post.to_dict(serial=True)['class_'], u'a')
+
+    def test_from_samples_with_nulls(self):
+        from micromodels import codegen
+        samples = [
+            {'day': '2012-01-01', 'at': '10:00:00', 'name': 'a',
+             'comments': [{'text': 'hi'}], 'days': ['2012-01-01'],
+             'replies': [{'text': 'hi'}], 'author': {'name': 'Eric'}},
+            {'day': None, 'at': None, 'name': None, 'comments': None,
+             'days': [None], 'replies': [None], 'author': None},
+        ]
+        models = self.load(codegen.from_samples(samples, 'Post'))
+        Post = models['Post']
+        self.assertEqual(
+            dict((name, type(field).__name__)
+                 for name, field in Post._clsfields.items()),
+            {'day': 'BaseField', 'at': 'BaseField', 'name': 'CharField',
+             'comments': 'BaseField', 'days': 'FieldCollectionField',
+             'replies': 'FieldCollectionField', 'author': 'ModelField'})
+        for sample in samples:
+            Post.from_dict(sample).to_dict(serial=True)
+
+    def test_from_schema(self):
+        from micromodels import codegen
+        schema = {
+            'title': 'Post',
+            'type': 'object',
+            'properties': {
+                'id': {'type': 'integer'},
+                'created': {'type': 'string', 'format': 'date-time'},
+                'rating': {'type': ['number', 'null']},
+                'author': {'$ref': '#/definitions/person'},
+                'editors': {'type': 'array',
+                            'items': {'$ref': '#/definitions/person'}},
+            },
+            'definitions': {'person': {
+                'title': 'Person', 'type': 'object',
+                'properties': {'full-name': {'type': 'string'}}}},
+        }
+        models = self.load(codegen.from_schema(schema))
+        Post, Person = models['Post'], models['Person']
+        self.assertEqual(Post._clsfields['author']._wrapped_class, Person)
+        self.assertEqual(Post._clsfields['editors']._wrapped_class, Person)
+        post = Post.from_dict({'rating': 4, 'author': {'full-name': 'Eric'},
+                               'created': '2012-01-01T10:00:00'})
+        self.assertEqual(post.rating, 4.0)
+        self.assertEqual(post.author.full_name, u'Eric')
+        self.assertRaises(ValueError, codegen.from_schema,
+                          {'type': 'array'})
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_run(self):
+        from micromodels import bench
+        report = bench.run(records=3, repeat=1)
+        self.assertEqual(sorted(report['results']),
+                         sorted(workload[0] for workload in bench.WORKLOADS))
+        for result in report['results'].values():
+            self.assertEqual(result['records'], 3)
+            self.assertTrue(result['records_per_second'] > 0)
+            self.assertTrue(result['bytes_held_per_record'] > 0)
+        json.dumps(report)
+        self.assertRaises(ValueError, bench.run_workload, 'unknown')
+
+
 class ModelTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -486,12 +2115,100 @@ class ModelTestCase(unittest.TestCase):
         self.assertEqual(json.loads(instance.to_json())['time'],
                          instance.time.isoformat())
 
+    def test_model_from_dicts(self):
+        items = [{'name': 'Eric', 'age': 18}, {'name': 'John', 'age': '19'}]
+        instances = list(self.Person.from_dicts(items))
+        self.assertEqual([i.to_dict() for i in instances],
+                         [self.data, {'name': 'John', 'age': 19}])
+
+        json_items = [json.dumps(item) for item in items]
+        instances = list(self.Person.from_dicts(json_items, is_json=True))
+        self.assertEqual([i.name for i in instances], ['Eric', 'John'])
+
+    def test_model_from_dicts_chunked(self):
+        items = [{'name': str(n), 'age': n} for n in range(5)]
+        chunks = list(self.Person.from_dicts(items, chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([p.age for chunk in chunks for p in chunk],
+                         range(5))
+
+    def test_model_from_dicts_workers(self):
+        items = [{'name': str(n), 'born': '2000-01-%02d' % (n + 1)}
+                 for n in range(25)]
+        expected = [PickledPerson.from_dict(item).to_dict()
+                    for item in items]
+        instances = list(PickledPerson.from_dicts(items, workers=2))
+        self.assertEqual([i.to_dict() for i in instances], expected)
+        chunks = list(CompactPickledPerson.from_dicts(
+            (json.dumps(item) for item in items), is_json=True,
+            chunk_size=10, workers=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        self.assertEqual([p.to_dict() for chunk in chunks for p in chunk],
+                         expected)
+
+    def test_model_from_dicts_workers_related_names(self):
+        items = [{'name': str(n), 'kids': [{'name': 'a'}, {'name': 'b'}]}
+                 for n in range(5)]
+        families = list(PickledFamily.from_dicts(items, workers=2))
+        self.assertEqual([f.name for f in families], map(str, range(5)))
+        for family in families:
+            self.assertTrue(family.kids[0].parent is family)
+            self.assertTrue(family.kids[1].parent is family)
+        self.assertEqual(families[1].kids[0].parent.name, '1')
+        items = [{'name': str(n), 'people': [{'name': 'a'}, {'name': 'b'}],
+                  'rows': [{'name': 'c', 'born': '1990-02-03'}]}
+                 for n in range(5)]
+        diaries = list(PickledDiary.from_dicts(items, workers=2))
+        self.assertEqual([d.name for d in diaries], map(str, range(5)))
+        for diary in diaries:
+            self.assertEqual(diary.people.converted(), 0)
+            self.assertEqual([p.name for p in diary.people], [u'a', u'b'])
+            self.assertTrue(diary.people[1].diary is diary)
+            self.assertEqual(len(diary.rows), 1)
+            self.assertEqual(diary.rows[0].born, date(1990, 2, 3))
+            self.assertTrue(diary.rows[0].diary is diary)
+
+    def test_model_pickling(self):
+        import pickle
+        data = {'name': 'Eric', 'born': '1990-02-03'}
+        eager = PickledPerson.from_dict(data)
+        eager.add_field('age', '18', micromodels.IntegerField())
+        lazy = PickledPerson.from_dict(data, lazy=True)
+        compact = CompactPickledPerson.from_dict({'name': 'Eric'})
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(eager, protocol))
+            self.assertEqual(copy.to_dict(), dict(eager.to_dict(), age=18))
+            self.assertEqual(copy._extra.keys(), ['age'])
+            copy = pickle.loads(pickle.dumps(lazy, protocol))
+            self.assertEqual(copy._raw, lazy._raw)
+            self.assertEqual(copy.born, date(1990, 2, 3))
+            copy = pickle.loads(pickle.dumps(compact, protocol))
+            self.assertEqual(copy.to_dict(), {'name': u'Eric'})
+
+    def test_model_from_json_lines(self):
+        from StringIO import StringIO
+        stream = StringIO('{"name": "Eric", "age": 18}\n\n'
+                          '{"name": "John", "age": 19}\n')
+        instances = list(self.Person.from_json_lines(stream))
+        self.assertEqual([(i.name, i.age) for i in instances],
+                         [('Eric', 18), ('John', 19)])
+
     def test_model_add_field(self):
         obj = self.Person.from_dict(self.data)
         obj.add_field('gender', 'male', micromodels.CharField())
         self.assertEqual(obj.gender, 'male')
         self.assertEqual(obj.to_dict(), dict(self.data, gender='male'))
 
+    def test_model_add_field_is_per_instance(self):
+        obj = self.Person.from_dict(self.data)
+        other = self.Person.from_dict(self.data)
+        self.assertTrue(obj._fields is self.Person._clsfields)
+        obj.add_field('gender', 'male', micromodels.CharField())
+        self.assertTrue('gender' in obj._fields)
+        self.assertFalse('gender' in other._fields)
+        self.assertFalse('gender' in self.Person._clsfields)
+        self.assertEqual(other.to_dict(), self.data)
+
     def test_model_late_assignment(self):
         instance = self.Person.from_dict(dict(name='Eric'))
         self.assertEqual(instance.to_dict(), dict(name='Eric'))